@@ -1,21 +1,24 @@
 """CLI client for creep"""
 
-import argparse
 import cmd # Command interpreter logic. Gives us the base class for the client
-import distutils.dir_util # Directory utilities
-import inspect # Functions to inspect live objects
 import json # JSON encoder and decoder
 import os # Miscellaneous operating system interfaces
+import re # Regular expressions
 import shlex # Lexical analysis of user input.
 import shutil # High-level file operations
-import subprocess # Spawn subprocesses, connect in/out pipes, obtain return codes
 import sys # System specific parameters and functions
-import tempfile # Temporary file utilities
-import zipfile # Zip file utilities
+
+# Modules that take a while to import (argparse, subprocess, zipfile, urllib,
+# sqlite3, ...) are imported by the commands that need them, so quick
+# commands like `creep version` start fast.
 
 from qi.console.client import Client
 from operator import attrgetter
 from .repository import Repository
+from .resolver import DependencyError, Resolver
+from .lockfile import Lockfile, LockfileError
+from .manifest import Manifest
+from .stash import Stash
 
 DEFAULT_TARGET = "1.16.5"
 
@@ -40,22 +43,113 @@ class CreepClient(Client, cmd.Cmd):
     # Directory for minecraft profile
     profiledir = ''
 
-    # Whether should install dependencies too
-    install_dependencies = True
+    # Maximum number of simultaneous downloads when installing
+    download_workers = 8
+
+    # Maximum number of simultaneous downloads from the same host
+    download_per_host = 4
+
+    # Storage for the package repository: 'memory' or 'sqlite'
+    repository_backend = 'memory'
+
+    # URL of the remote registry, if not the default one
+    repository_url = ''
+
+    # Whether to use a stale registry right away and refresh it in the background
+    background_refresh = False
+
+    # Maximum size of the download cache in bytes (or e.g. '2G'), 0 for no limit
+    cache_max_size = 0
 
     def __init__(self, **kwargs):
         """Constructor"""
         cmd.Cmd.__init__(self)
         Client.__init__(self, **kwargs)
 
-        self.update_version_with_git_describe()
         self.update_paths()
         self.load_options()
 
-        self.create_repository()
+        # The artifact store and the repository are loaded the first time
+        # they are used
+        self._store = None
+        self._repository = None
+
+        # Manifests of the directories being installed into, by path
+        self.manifests = {}
+
+    @property
+    def store(self):
+        if self._store is None:
+            from .store import ArtifactStore
+            self._store = ArtifactStore(self.appdir + os.sep + 'cache', self.parse_size(self.cache_max_size) or 0)
+
+        return self._store
+
+    @property
+    def repository(self):
+        if self._repository is None:
+            self.create_repository()
+
+        return self._repository
+
+    def default(self, line):
+        print(self.colortext("Unknown command '{}'".format(line), self.terminal.C_RED))
+        return 1
+
+    def run_commands(self, commands):
+        """Run commands one after the other, stopping at the first one that fails
+
+        Empty commands and comments (starting with #) are skipped. Returns
+        the status of the command that failed, or 0.
+        """
+        for command in commands:
+            command = command.strip()
+            if not command or command.startswith('#'):
+                continue
+
+            status = self.onecmd(command)
+            if status:
+                print(self.colortext("Stopped after failed command '{}'".format(command), self.terminal.C_RED))
+                return status
+
+        return 0
+
+    def split_commands(self, text):
+        """Split a line of commands separated by semicolons, except in quotes"""
+        commands = ['']
+        quote = None
+        for char in text:
+            if quote:
+                if char == quote:
+                    quote = None
+            elif char in ['"', "'"]:
+                quote = char
+            elif char == ';':
+                commands.append('')
+                continue
+            commands[-1] += char
+
+        return commands
+
+    def read_script(self, path):
+        """Read the commands from a script file, one command per line"""
+        if not os.path.isfile(path):
+            print(self.colortext("File '{}' not found".format(path), self.terminal.C_RED))
+            return None
+
+        with open(path) as fp:
+            return fp.read().splitlines()
+
+    def reload(self):
+        """Read the options again and load the repository again when next used"""
+        self.load_options()
+        if self._store is not None:
+            self._store.max_size = self.parse_size(self.cache_max_size) or 0
+        self._repository = None
 
     def do_version(self, args):
         """Display creep version"""
+        self.update_version_with_git_describe()
         print(self.colortext("Creep v{}".format(self.VERSION), self.terminal.C_GREEN))
         self.display_target()
         self.display_profile()
@@ -73,7 +167,8 @@ Examples:
             self.minecraft_target = args
 
         self.display_target()
-        self.repository.set_minecraft_target(self.minecraft_target)
+        if self._repository is not None:
+            self._repository.set_minecraft_target(self.minecraft_target)
         self.save_options()
 
     def display_target(self):
@@ -86,14 +181,32 @@ Examples:
             options = json.load(open(options_path))
             self.minecraft_target = options.get('minecraft_target', DEFAULT_TARGET)
             self.profiledir = options.get('profile_dir', self.minecraftdir)
+            self.download_workers = options.get('download_workers', self.download_workers)
+            self.download_per_host = options.get('download_per_host', self.download_per_host)
+            self.repository_backend = options.get('repository_backend', self.repository_backend)
+            self.repository_url = options.get('repository_url', self.repository_url)
+            self.background_refresh = options.get('background_refresh', self.background_refresh)
+            self.cache_max_size = options.get('cache_max_size', self.cache_max_size)
         else:
             self.minecraft_target = DEFAULT_TARGET
             self.profiledir = self.minecraftdir
 
     def save_options(self):
         options_path = self.appdir + os.sep + 'options.json'
+        options = {
+            'minecraft_target': self.minecraft_target,
+            'profile_dir': self.profiledir,
+            'download_workers': self.download_workers,
+            'download_per_host': self.download_per_host,
+            'repository_backend': self.repository_backend,
+            'background_refresh': self.background_refresh,
+            'cache_max_size': self.cache_max_size,
+        }
+        if self.repository_url:
+            options['repository_url'] = self.repository_url
+
         with open(options_path, 'w') as outfile:
-            json.dump({'minecraft_target': self.minecraft_target, 'profile_dir': self.profiledir}, outfile)
+            json.dump(options, outfile)
 
     def do_profile(self, args):
         """Set the path to the profile where you want to manage mods
@@ -111,8 +224,9 @@ Examples:
                     "Invalid directory '{}'".format(new_profile_dir),
                     self.terminal.C_RED
                 ))
-            else:
-                self.profiledir = new_profile_dir
+                return 1
+
+            self.profiledir = new_profile_dir
 
         self.display_profile()
         self.save_options()
@@ -134,6 +248,8 @@ Examples:
 """
         args = shlex.split(args)
 
+        import argparse
+
         parser = argparse.ArgumentParser(add_help=False, prog="creep list")
         parser.add_argument("installed", nargs="?")
         parser.add_argument("-s", "--short", action="store_true")
@@ -150,12 +266,18 @@ Examples:
     def get_packages_in_dir(
         self, dir_name, display_list=False, include_unknowns=True, short_form=False
     ):
-        """Get the packages in a given directory"""
+        """Get the packages in a given directory
+
+        Files are identified with the directory's manifest, and only files
+        that are new or changed since they were recorded are looked up in the
+        registry. Jars the registry doesn't know by name are identified by
+        the mod metadata inside them.
+        """
 
-        ignore = ['.DS_Store']
+        ignore = ['.DS_Store', Manifest.FILENAME]
         files = []
         try:
-            files = os.listdir(dir_name)
+            files = [name for name in os.listdir(dir_name) if name not in ignore]
         except OSError:
             pass
 
@@ -165,21 +287,36 @@ Examples:
                 print("No mods installed")
             return False
 
+        manifest = Manifest(dir_name)
         library = {}
-        packages = []
-        unknownfiles = []
+        unidentified = []
         for name in files:
-            if name in ignore:
+            try:
+                stat = os.stat(dir_name + os.sep + name)
+            except OSError:
+                continue
+
+            entry = manifest.get(name, stat)
+            # Unknown files are looked up again once the registry changed
+            if entry is not None and (entry.get('name') or entry.get('checked') == self.repository.version_hash):
+                library[name] = manifest.create_package(entry)
                 continue
+
             package = self.repository.fetch_package_byfilename(name)
-            if not package:
-                library[name] = None
-                unknownfiles.append(name)
-            else:
+            if package:
+                digest = None
+                if os.path.isfile(dir_name + os.sep + name):
+                    digest = self.get_installed_digest(dir_name + os.sep + name, package)
+                manifest.add(name, package, digest)
                 library[name] = package
-                packages.append(package)
+            else:
+                unidentified.append(name)
+
+        if unidentified:
+            self.identify_files(dir_name, unidentified, library, manifest)
 
-        packages.sort(key=attrgetter('name'))
+        packages = sorted([package for package in library.values() if package], key=attrgetter('name'))
+        unknownfiles = [name for name in files if name in library and not library[name]]
 
         if display_list:
             if not short_form:
@@ -193,10 +330,74 @@ Examples:
                 self.print_package(package, short_form=short_form)
             if include_unknowns:
                 for name in unknownfiles:
+                    metadata = manifest.load().get(name, {}).get('metadata')
+                    if metadata:
+                        name = "{} ({} {}, not in the registry)".format(name, metadata['modid'], metadata['version'])
                     print(self.colortext(name, self.terminal.C_RED))
 
+        manifest.prune(files)
+        manifest.save()
+
         return library
 
+    def identify_files(self, dir_name, names, library, manifest):
+        """Identify files by the mod metadata in them (mods.toml, mcmod.info
+        or fabric.mod.json), recording the results in the manifest"""
+        from .jarinfo import JarInfo
+
+        jarinfo = JarInfo(self.appdir + os.sep + 'jarinfo.json')
+        paths = [dir_name + os.sep + name for name in names if name.endswith('.jar')]
+        metadata = jarinfo.get_all_metadata(paths)
+        jarinfo.save()
+
+        for name in names:
+            info = metadata.get(dir_name + os.sep + name)
+            package = self.find_package_by_metadata(info) if info else None
+            library[name] = package or None
+            manifest.add(name, package, metadata=info, registry_version=self.repository.version_hash)
+
+    def find_package_by_metadata(self, metadata):
+        """Find the package matching the mod id and version of a jar"""
+        if not metadata['version']:
+            return None
+
+        names = [metadata['modid'], metadata['modid'].replace('_', '-')]
+        if metadata['name']:
+            names.append(re.sub(r'[^a-z0-9]+', '-', metadata['name'].lower()).strip('-'))
+
+        # Registry versions are often prefixed with the minecraft version
+        versions = [metadata['version'], "{}-{}".format(self.minecraft_target, metadata['version'])]
+
+        for name in names:
+            for version in versions:
+                package = self.repository.fetch_package("{}:{}".format(name, version))
+                if package:
+                    return package
+
+        return None
+
+    def get_installed_digest(self, path, package):
+        """Get the SHA-256 of an installed file, from the cache index if it is
+        the same file as the cached one"""
+        cache_path = self.store.cachedir + os.sep + package.installdir + os.sep + os.path.basename(path)
+        try:
+            stat = os.stat(path)
+            cache_stat = os.stat(cache_path)
+        except OSError:
+            return self.store.hash_file(path)
+
+        if (stat.st_size, stat.st_mtime_ns) == (cache_stat.st_size, cache_stat.st_mtime_ns):
+            return self.store.get_digest(cache_path)
+
+        return self.store.hash_file(path)
+
+    def get_manifest(self, directory):
+        """Get the manifest of a directory, shared while installing"""
+        if directory not in self.manifests:
+            self.manifests[directory] = Manifest(directory)
+
+        return self.manifests[directory]
+
     def display_packages(self, short_form=False):
         """Display list of packages available"""
         for package in self.repository.unique_packages:
@@ -247,17 +448,34 @@ Examples:
     def do_search(self, args):
         """Search for a package (mod) in the package registry
 
-Usage: creep search <packagename>
+Usage: creep search [options] <term> [<term>...] [OR <term>...]
+  -f, --fuzzy   Find packages with names similar to the term (typo tolerant)
+
+Every term must match the start of a word in a package's name, keywords or
+description. Use OR (or |) to search for alternatives. The best matches are
+listed first. When nothing matches, packages with similar names are listed.
 
 Examples: creep search jade
           creep search optifine
           creep search tools
           creep search blake
+          creep search iron furnace
+          creep search minimap OR worldmap
+          creep search -f tinkers contruct
 """
         if args == '':
             return False
 
-        packages = self.repository.search(args)
+        args = shlex.split(args)
+
+        import argparse
+
+        parser = argparse.ArgumentParser(add_help=False, prog='creep search')
+        parser.add_argument('terms', nargs='*')
+        parser.add_argument('-f', '--fuzzy', action='store_true')
+        pargs, _ = parser.parse_known_args(args)
+
+        packages = self.repository.search(' '.join(pargs.terms), fuzzy=pargs.fuzzy)
         for package in packages:
             self.print_package(package)
 
@@ -273,17 +491,25 @@ Example: creep info slimeknights/tinkers-construct
 
         package = self.repository.fetch_package(args)
         if not package:
-            print(self.colortext("Unknown package '{}'".format(args), self.terminal.C_RED))
+            self.display_unknown_package(args)
             return 1
 
         self.print_package_details(package)
 
+    def display_unknown_package(self, packagename):
+        print(self.colortext("Unknown package '{}'".format(packagename), self.terminal.C_RED))
+
+        suggestions = self.repository.suggest_packages(packagename)
+        if suggestions:
+            print("Did you mean: {}?".format(', '.join(suggestions)))
+
     def do_install(self, args):
         """Install a package (mod). This will install a given mod and its dependencies too
 
 Usage: creep install [options] (<packagename>|-l <filename>)
   -n, --no-dependencies        Do not install dependencies automatically
   -l, --listfile <filename>    Install packages from file; one package per line
+  -j, --jobs <number>          Number of packages to download at the same time
 
 <packagename> can be the name of the package in one of the following formats:
   * package
@@ -299,6 +525,13 @@ Examples: creep install just-enough-items
           creep install just-enough-items:1.12.2-4.9.2.196
           creep install mezz/just-enough-items:1.12.2-4.9.2.196
           creep install -l mymodlist.txt
+          creep install -j 16 -l mymodlist.txt
+          creep install --locked
+          creep install --locked server.lock
+
+With --locked, the exact packages in a lockfile (creep.lock by default, see
+`creep help lock`) are installed without resolving anything, and each file
+is verified against the hash in the lockfile.
 """
         args = shlex.split(args)
 
@@ -306,116 +539,648 @@ Examples: creep install just-enough-items
             print(self.colortext("Missing argument", self.terminal.C_RED))
             return 1
 
+        import argparse
+
         parser = argparse.ArgumentParser(add_help=False, prog='creep install')
         parser.add_argument('packages', nargs='*')
         parser.add_argument('-n', '--no-dependencies', action='store_true')
         parser.add_argument('-l', '--listfile', help='Install packages from file')
+        parser.add_argument('-j', '--jobs', type=int, help='Number of parallel downloads')
+        parser.add_argument('--locked', nargs='?', const=Lockfile.DEFAULT_NAME, help='Install from lockfile')
 
         (pargs, remaining_args) = parser.parse_known_args(args)
 
         if pargs.no_dependencies:
             print(self.colortext("Performing install and skipping dependencies\n", self.terminal.C_YELLOW))
-            self.install_dependencies = False
 
-        if pargs.packages:
-            # Handle install individual package
-            for packagename in pargs.packages:
-                self.install_package(packagename)
+        if pargs.locked:
+            lockfile = self.read_lockfile(pargs.locked)
+            if lockfile is None:
+                return 1
+            return self.install_resolved(lockfile.packages, pargs.jobs)
+
+        # Individual packages and the listfile are installed as one batch so
+        # all their downloads can happen at the same time
+        packagenames = list(pargs.packages)
 
         if pargs.listfile:
             # Handle install from listfile
-            self.install_from_listfile(pargs.listfile)
+            listed = self.read_listfile(pargs.listfile)
+            if listed is False:
+                return 1
+            packagenames.extend(listed)
+
+        return self.install_packages(packagenames, not pargs.no_dependencies, pargs.jobs)
 
     def install_package(self, packagename):
-        package = self.repository.fetch_package(packagename)
-        if not package:
-            print(self.colortext("Unknown package '{}'".format(packagename), self.terminal.C_RED))
+        return self.install_packages([packagename])
+
+    def install_packages(self, packagenames, install_dependencies=True, download_workers=None):
+        """Install the given packages and their dependencies
+
+        The full install plan is resolved and displayed first, then every
+        package not in the cache yet is downloaded concurrently before
+        anything gets installed into the profile. The packages are installed
+        in a transaction, so the profile only changes once all of them are
+        in place, and an interrupted install is resumed by running it again.
+        """
+        packages = self.resolve_packages(packagenames, install_dependencies)
+        if packages is False:
             return 1
 
-        print(self.colortext("Installing package {}".format(package), self.terminal.C_BLUE))
+        status = 1 if self.resolver.unknown else 0
+
+        if not packages:
+            return status
+
+        return self.install_resolved(packages, download_workers) or status
+
+    def install_resolved(self, packages, download_workers=None):
+        """Download and install packages that are already resolved"""
+        self.display_install_plan(packages)
+
+        failed = self.download_packages(packages, download_workers)
+
+        not_installed = self.apply_changes(packages, failed)
+
+        self.enforce_cache_limit()
 
-        # Install any required packages
-        # Warning: does not handle versions or circular dependencies
-        for dependency in package.require:
-            if dependency == 'minecraft' or dependency == 'forge':
+        return 1 if failed or not_installed else 0
+
+    def apply_changes(self, packages, failed=(), removed=()):
+        """Install packages and remove files from the profile in one transaction
+
+        Removed files are given as paths relative to the profile dir, e.g.
+        'mods/vendor_name_1.0.jar'. They are removed before installing.
+        Returns the packages that failed to install.
+        """
+        from .strategy import StrategyError
+        from .transaction import InstallTransaction
+
+        self.manifests = {}
+        transaction = InstallTransaction(self.profiledir)
+        keys = ["{}:{}".format(package.name, package.version) for package in packages]
+        if transaction.begin(keys + ['-' + path for path in removed]):
+            print(self.colortext("Resuming interrupted install", self.terminal.C_YELLOW))
+
+        for path in removed:
+            if transaction.is_done('-' + path):
                 continue
-            if self.install_dependencies:
-                print(self.colortext("Installing dependency '{}'".format(dependency), self.terminal.C_CYAN))
-                self.install_package(dependency)
-            else:
-                print(self.colortext("Skipping dependency '{}'".format(dependency), self.terminal.C_YELLOW))
+            installdir, filename = path.split('/', 1)
+            staged_path = transaction.get_staging_dir(installdir) + os.sep + filename
+            if os.path.lexists(staged_path):
+                os.remove(staged_path)
+            self.get_manifest(os.path.dirname(staged_path)).remove(filename)
+            print(self.colortext("  Removed '{0}'".format(filename), self.terminal.C_RED))
+            transaction.mark_done('-' + path)
+
+        not_installed = []
+        for package, key in zip(packages, keys):
+            if package in failed:
+                print(self.colortext("  Skipped mod '{0}', download failed".format(package.name), self.terminal.C_RED))
+                continue
+            if transaction.is_done(key):
+                print(self.colortext("  Already installed mod '{0}'".format(package.name), self.terminal.C_GREEN))
+                continue
+            try:
+                self.install_package_files(package, transaction)
+            except StrategyError as e:
+                print(self.colortext(str(e), self.terminal.C_RED))
+                print(self.colortext("  Failed to install mod '{0}'".format(package.name), self.terminal.C_RED))
+                not_installed.append(package)
+                continue
+            transaction.mark_done(key)
+
+        # Written once for the whole transaction; the entries of packages
+        # installed before an interruption are recreated when listing
+        for manifest in self.manifests.values():
+            manifest.save()
+
+        transaction.commit()
+        self.manifests = {}
+
+        return not_installed
+
+    def resolve_packages(self, packagenames, install_dependencies=True):
+        """Resolve package names and their dependencies into an install plan
+
+        Returns the packages in the order they should be installed, or False
+        if the dependencies can't be resolved
+        """
+        self.resolver = Resolver(self.repository, install_dependencies)
+
+        try:
+            packages = self.resolver.resolve(packagenames)
+        except DependencyError as e:
+            print(self.colortext(str(e), self.terminal.C_RED))
+            return False
 
+        for packagename in self.resolver.unknown:
+            self.display_unknown_package(packagename)
+
+        for dependency in self.resolver.skipped:
+            print(self.colortext("Skipping dependency '{}'".format(dependency), self.terminal.C_YELLOW))
+
+        return packages
+
+    def display_install_plan(self, packages):
+        """Display the packages that will be installed, in order"""
+        print(self.colortext("Install plan ({} packages):".format(len(packages)), self.terminal.C_BLUE))
+        for package in packages:
+            self.print_package(package, short_form=True)
+
+    def get_package_cachedir(self, package):
+        """Get the cache directory where a package's artifact is saved"""
+        cachedir = self.appdir + os.sep + 'cache' + os.sep + package.installdir
+
+        if not os.path.isdir(cachedir):
+            os.mkdir(cachedir)
+
+        return cachedir
+
+    def download_packages(self, packages, download_workers=None):
+        """Download all packages that aren't in the cache yet
+
+        download_workers overrides the configured number of simultaneous
+        downloads. Returns the list of packages that failed to download
+        """
+        jobs = []
+        for package in packages:
+            if package.type == 'collection':
+                continue
+            cachedir = self.get_package_cachedir(package)
+            if not self.store.has_file(cachedir + os.sep + package.get_local_filename(), package.sha256):
+                jobs.append((package, cachedir))
+
+        if not jobs:
+            self.store.save()
+            return []
+
+        print(self.colortext("Downloading {0} mod(s)...".format(len(jobs)), self.terminal.C_YELLOW))
+
+        from .downloader import Downloader
+
+        downloader = Downloader(
+            download_workers or self.download_workers,
+            self.download_per_host,
+            on_complete=self.display_download_progress,
+            store=self.store,
+            timeout=self.repository.timeout,
+        )
+        failed = downloader.download_all(jobs)
+        self.store.save()
+
+        return failed
+
+    def display_download_progress(self, package, result, completed, total):
+        if result:
+            message = "  [{0}/{1}] Downloaded mod '{2}'".format(completed, total, package.name)
+            print(self.colortext(message, self.terminal.C_YELLOW))
+        else:
+            message = "  [{0}/{1}] Download failed for mod '{2}' from {3}".format(
+                completed, total, package.name, package.get_download_location()
+            )
+            print(self.colortext(message, self.terminal.C_RED))
+
+    def install_package_files(self, package, transaction=None):
+        """Install a package's downloaded artifact into the profile
+
+        With a transaction, the files go into its staging directory instead
+        and appear in the profile when the transaction is committed.
+        """
         if package.type == 'collection':
             # Collection only has dependencies
             print(self.colortext("  Installed collection '{0}'".format(package.name), self.terminal.C_GREEN))
         else:
-            cachedir = self.appdir + os.sep + 'cache' + os.sep + package.installdir
-
-            if not os.path.isdir(cachedir):
-                os.mkdir(cachedir)
-
-            if not os.path.isfile(cachedir + os.sep + package.get_local_filename()):
-                print(self.colortext("  Downloading mod '{0}' from {1}".format(package.name, package.get_download_location()), self.terminal.C_YELLOW))
-                downloadResult = package.download(cachedir)
-
-                if not downloadResult:
-                    print("Download failed.")
-                    return False
+            cachedir = self.get_package_cachedir(package)
 
             # Most of the time this is the '~/.minecraft/mods' dir, but some mods have an alternate location for artifacts
-            savedir = self.profiledir + os.sep + package.installdir
+            installdir = self.profiledir + os.sep + package.installdir
 
-            if not os.path.isdir(savedir):
-                print(self.colortext("Creating directory '{0}'".format(savedir)))
-                os.mkdir(savedir)
+            if transaction:
+                savedir = transaction.get_staging_dir(package.installdir)
+            else:
+                savedir = installdir
+                if not os.path.isdir(savedir):
+                    print(self.colortext("Creating directory '{0}'".format(savedir)))
+                    os.mkdir(savedir)
 
             if package.installstrategy:
                 self.install_with_strategy(package.installstrategy, package, cachedir, savedir)
 
-            shutil.copyfile(cachedir + os.sep + package.get_local_filename(), savedir + os.sep + package.get_local_filename())
+            cache_path = cachedir + os.sep + package.get_local_filename()
+            self.store.install_file(cache_path, savedir + os.sep + package.get_local_filename())
 
-            print(self.colortext("  Installed mod '{0}' in '{1}'".format(package.name, savedir + os.sep + package.get_local_filename()), self.terminal.C_GREEN))
+            manifest = self.get_manifest(savedir)
+            manifest.add(package.get_local_filename(), package, self.store.get_digest(cache_path))
+            if not transaction:
+                manifest.save()
+
+            print(self.colortext("  Installed mod '{0}' in '{1}'".format(package.name, installdir + os.sep + package.get_local_filename()), self.terminal.C_GREEN))
 
     def install_from_listfile(self, listfile):
+        packagenames = self.read_listfile(listfile)
+        if packagenames is False:
+            return 1
+
+        return self.install_packages(packagenames)
+
+    def read_listfile(self, listfile):
+        """Read the package names from a listfile, one package per line"""
         print("Reading packages from file '{}'...".format(listfile))
 
         if not os.path.isfile(listfile):
             print(self.colortext("File '{}' not found".format(listfile), self.terminal.C_RED))
-            return 1
+            return False
 
         # Read file and attempt to parse each line as a package name
+        packagenames = []
         with open(listfile) as fp:
             for line in fp:
                 args = line.split()
-                self.install_package(args[0])
+                if args:
+                    packagenames.append(args[0])
+
+        return packagenames
 
     def install_with_strategy(self, installstrategy, package, cachedir, savedir):
+        """Install the output of a package's install strategy
+
+        Raises StrategyError when the strategy fails, e.g. a verify step.
+        """
+        from .strategy import InstallStrategy
+
         print("Installing with strategy: " + installstrategy)
 
-        if ';' in installstrategy:
-            strategies = installstrategy.split(';')
+        archive_path = cachedir + os.sep + package.get_local_filename()
+        digest = self.store.get_digest(archive_path)
+        tempdir = None
+        if digest:
+            outputdir = self.store.get_extracted_dir(digest, installstrategy)
         else:
-            strategies = [installstrategy]
-
-        # set up a temppath where we will work
-        tmppath = tempfile.gettempdir() + os.sep + package.name.replace('/', '_')
-        if os.path.exists(tmppath):
-            shutil.rmtree(tmppath)
-        os.mkdir(tmppath)
-
-        for strategy in strategies:
-            args = shlex.split(strategy)
-            if args[0] == 'unzip':
-                print('Unzipping archive: ' + cachedir + os.sep + package.get_local_filename())
-                self.unzip(cachedir + os.sep + package.get_local_filename(), tmppath)
-            elif args[0] == 'move':
-                print('Moving files: ' + args[1])
-                path = args[1]
-                if path[-2:] == '/*':
-                    path = path.replace('/*', '')
-                    distutils.dir_util.copy_tree(tmppath + os.sep + path, savedir)
+            # The archive couldn't be hashed, so its output can't be shared
+            # with other installs; build it where it's thrown away afterwards
+            import tempfile
+            tempdir = tempfile.mkdtemp(prefix='creep-extract-')
+            outputdir = tempdir + os.sep + 'output'
+
+        strategy = InstallStrategy(installstrategy)
+        try:
+            strategy.run(archive_path, outputdir, savedir)
+        finally:
+            if tempdir:
+                shutil.rmtree(tempdir, ignore_errors=True)
+
+        print("  Steps: " + strategy.describe_timings())
+
+    def do_cache(self, args):
+        """Manage the cache of downloaded packages
+
+Usage: creep cache <subcommand>
+
+Subcommands:
+ - stats : Show the size of the cache and its limit
+ - gc [--max-size <size>] : Remove cached files that are not installed in the
+        profile or a stash, least recently used first, until the cache is
+        within its maximum size. Also cleans up unused leftovers.
+ - clear : Remove everything from the cache
+
+The maximum size is set with "cache_max_size" in ~/.creep/options.json, in
+bytes or with a K, M or G suffix (e.g. "2G"). When set, the least recently
+used files are removed automatically after installing.
+
+Examples: creep cache stats
+          creep cache gc
+          creep cache gc --max-size 500M
+          creep cache clear
+"""
+        args = shlex.split(args)
+
+        import argparse
+
+        parser = argparse.ArgumentParser(add_help=False, prog='creep cache')
+        parser.add_argument('subcommand', nargs='?', default='stats')
+        parser.add_argument('--max-size')
+        pargs, _ = parser.parse_known_args(args)
+
+        if pargs.subcommand == 'stats':
+            stats = self.store.get_stats()
+            print("Cache directory: {}".format(self.store.cachedir))
+            print("Files: {}".format(stats['files']))
+            print("Unique files: {}".format(stats['objects']))
+            print("Size: {}".format(self.format_size(stats['total_size'])))
+            print("Held by stashes: {}".format(self.format_size(stats['stashed_size'])))
+            if stats['max_size']:
+                print("Maximum size: {}".format(self.format_size(stats['max_size'])))
+            else:
+                print("Maximum size: unlimited")
+            self.store.save()
+            return 0
+
+        if pargs.subcommand == 'gc':
+            if pargs.max_size:
+                max_size = self.parse_size(pargs.max_size)
+                if max_size is None:
+                    return 1
+                self.store.max_size = max_size
+            before = self.store.get_stats()['total_size']
+            self.store.update_stashed(self.get_stashed_digests())
+            removed = self.store.collect_garbage(self.get_protected_cache_keys())
+            self.store.save()
+            freed = before - self.store.get_stats()['total_size']
+            print(self.colortext(
+                "Removed {} unused file(s), freed {}.".format(len(removed), self.format_size(freed)),
+                self.terminal.C_GREEN
+            ))
+            return 0
+
+        if pargs.subcommand == 'clear':
+            size = self.store.get_stats()['total_size']
+            self.store.clear()
+            print(self.colortext("Cleared cache, freed {}.".format(self.format_size(size)), self.terminal.C_GREEN))
+            return 0
+
+        print(self.colortext("Cache: Invalid subcommand {}".format(pargs.subcommand), self.terminal.C_RED))
+        return 1
+
+    def enforce_cache_limit(self):
+        """Evict the least recently used cached files if over the maximum size"""
+        if self.store.is_over_limit():
+            # Stashes may have been dropped since their objects were counted
+            self.store.update_stashed(self.get_stashed_digests())
+        if self.store.is_over_limit():
+            evicted = self.store.evict(self.store.max_size, self.get_protected_cache_keys())
+            if evicted:
+                print(self.colortext("Removed {} unused file(s) from the cache".format(len(evicted)), self.terminal.C_YELLOW))
+
+        self.store.save()
+
+    def get_protected_cache_keys(self):
+        """Get the cache keys of files that are installed in the profile or in a
+        stash, and the hashes of the stashed files"""
+        keys = set()
+        for installdir in os.listdir(self.store.cachedir):
+            if installdir in ['objects', 'extracted'] or not os.path.isdir(self.store.cachedir + os.sep + installdir):
+                continue
+            try:
+                for name in os.listdir(self.profiledir + os.sep + installdir):
+                    keys.add(installdir + '/' + name)
+            except OSError:
+                pass
+
+        # Stashed files, and the objects they share
+        for name in self.get_stashes():
+            for filename in Stash(self.get_stashes_dir() + os.sep + name).load():
+                keys.add('mods/' + filename)
+        keys.update(self.get_stashed_digests())
+
+        return keys
+
+    def get_stashed_digests(self):
+        """Get the hashes of the files in all stashes"""
+        digests = set()
+        for name in self.get_stashes():
+            for entry in Stash(self.get_stashes_dir() + os.sep + name).load().values():
+                if entry.get('sha256'):
+                    digests.add(entry['sha256'])
+
+        return digests
+
+    def parse_size(self, size):
+        """Parse a size in bytes, with an optional K, M or G suffix, None if
+        it is invalid"""
+        if isinstance(size, int):
+            return size
+
+        units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+        size = str(size).strip().upper().rstrip('B')
+        try:
+            if size and size[-1] in units:
+                return int(float(size[:-1]) * units[size[-1]])
+            return int(size or 0)
+        except ValueError:
+            print(self.colortext("Invalid size '{}'".format(size), self.terminal.C_RED))
+            return None
+
+    def format_size(self, size):
+        for unit in ['bytes', 'KB', 'MB', 'GB']:
+            if size < 1024 or unit == 'GB':
+                break
+            size = size / 1024.0
+
+        if unit == 'bytes':
+            return "{} {}".format(int(size), unit)
+        return "{:.1f} {}".format(size, unit)
+
+    def do_lock(self, args):
+        """Write a lockfile with the exact packages to install
+
+Usage: creep lock [-n] [-o <lockfile>] [-l <listfile>] [<package> ...]
+  -n, --no-dependencies   Don't include the dependencies of the packages
+  -o, --output            Lockfile to write (default creep.lock)
+  -l, --listfile          Lock the packages listed in a file
+
+Resolves the packages and their dependencies and writes the version,
+download URL, file name and SHA-256 hash of each one to the lockfile.
+Packages without a hash in the registry are downloaded to compute it.
+Install the locked packages with `creep install --locked` or
+`creep sync creep.lock`.
+
+Examples: creep lock -l modlist.txt
+          creep lock -o server.lock tinkers jei
+"""
+        args = shlex.split(args)
+
+        import argparse
+
+        parser = argparse.ArgumentParser(add_help=False, prog='creep lock')
+        parser.add_argument('packages', nargs='*')
+        parser.add_argument('-n', '--no-dependencies', action='store_true')
+        parser.add_argument('-o', '--output', default=Lockfile.DEFAULT_NAME)
+        parser.add_argument('-l', '--listfile')
+        pargs, _ = parser.parse_known_args(args)
+
+        packagenames = list(pargs.packages)
+        if pargs.listfile:
+            listed = self.read_listfile(pargs.listfile)
+            if listed is False:
+                return 1
+            packagenames.extend(listed)
+
+        if not packagenames:
+            print(self.colortext("Missing argument", self.terminal.C_RED))
+            return 1
+
+        packages = self.resolve_packages(packagenames, not pargs.no_dependencies)
+        if packages is False or self.resolver.unknown:
+            print(self.colortext("Not writing lockfile, some packages could not be resolved", self.terminal.C_RED))
+            return 1
+
+        # The hash of the artifact is needed to lock it
+        unhashed = [package for package in packages if package.type != 'collection' and not package.sha256]
+        if self.download_packages(unhashed):
+            print(self.colortext("Not writing lockfile, some packages could not be downloaded", self.terminal.C_RED))
+            return 1
+        digests = {}
+        for package in unhashed:
+            cache_path = self.get_package_cachedir(package) + os.sep + package.get_local_filename()
+            digests[package.name] = self.store.get_digest(cache_path)
+        self.store.save()
+
+        Lockfile(self.minecraft_target, packages, digests).save(pargs.output)
+        print(self.colortext("Locked {} package(s) in {}".format(len(packages), pargs.output), self.terminal.C_GREEN))
+        return 0
+
+    def read_lockfile(self, path):
+        """Read a lockfile, returns None if it can't be read"""
+        try:
+            lockfile = Lockfile.load(path)
+        except LockfileError as e:
+            print(self.colortext(str(e), self.terminal.C_RED))
+            return None
+
+        if lockfile.minecraft_target and lockfile.minecraft_target != self.minecraft_target:
+            print(self.colortext(
+                "Lockfile is for minecraft version {}, targeting {}".format(lockfile.minecraft_target, self.minecraft_target),
+                self.terminal.C_YELLOW
+            ))
+
+        return lockfile
+
+    def do_sync(self, args):
+        """Make the installed mods match a list of packages
+
+Usage: creep sync [-n] [--dry-run] <listfile|lockfile>
+  -n, --no-dependencies   Don't include the dependencies of the packages
+  --dry-run               Only show what would change
+
+Resolves the packages in the listfile (one package per line, like
+`creep install -l`) and compares them with the mods installed in the profile.
+Only the differences are applied: missing mods are installed, mods that are
+not in the list are removed and mods installed at another version are
+replaced. Files creep doesn't know about are left alone.
+
+With a lockfile (see `creep help lock`) the locked packages are used as they
+are, without resolving them.
+
+Example: creep sync modlist.txt
+"""
+        args = shlex.split(args)
+
+        import argparse
+
+        parser = argparse.ArgumentParser(add_help=False, prog='creep sync')
+        parser.add_argument('listfile', nargs='?')
+        parser.add_argument('-n', '--no-dependencies', action='store_true')
+        parser.add_argument('--dry-run', action='store_true')
+        pargs, _ = parser.parse_known_args(args)
+
+        if not pargs.listfile:
+            print(self.colortext("Missing argument", self.terminal.C_RED))
+            return 1
+
+        if Lockfile.is_lockfile(pargs.listfile):
+            lockfile = self.read_lockfile(pargs.listfile)
+            if lockfile is None:
+                return 1
+            packages = lockfile.packages
+            status = 0
+        else:
+            packagenames = self.read_listfile(pargs.listfile)
+            if packagenames is False:
+                return 1
+
+            packages = self.resolve_packages(packagenames, not pargs.no_dependencies)
+            if packages is False:
+                return 1
+
+            status = 1 if self.resolver.unknown else 0
+
+        added, replaced, removed, unchanged = self.get_sync_changes(packages)
+        self.display_sync_changes(added, replaced, removed, unchanged)
+
+        if pargs.dry_run or not (added or replaced or removed):
+            return status
+
+        installs = added + [package for _, package in replaced]
+        removals = [path for path, _ in removed] + [path for path, _ in replaced]
+
+        failed = self.download_packages(installs)
+        if failed:
+            status = 1
+
+        if self.apply_changes(installs, failed, removals):
+            status = 1
+
+        self.enforce_cache_limit()
+
+        return status
+
+    def get_sync_changes(self, packages):
+        """Compare the desired packages with the installed mods
+
+        Only the file names are compared, so an unchanged profile is checked
+        with a single directory listing. Returns the packages to add, the
+        (path, package) pairs to replace, the (path, package) pairs to remove
+        and the number of unchanged packages.
+        """
+        library = self.get_packages_in_dir(self.profiledir + os.sep + 'mods') or {}
+
+        # A package can be installed more than once, e.g. in two versions
+        installed = {}
+        for filename in sorted(library):
+            package = library[filename]
+            if package:
+                installed.setdefault(package.name, []).append(('mods/' + filename, package))
+
+        added = []
+        replaced = []
+        removed = []
+        unchanged = 0
+        wanted = set()
+        for package in packages:
+            if package.type == 'collection':
+                continue
+            wanted.add(package.name)
+            filename = package.get_local_filename()
+            current = installed.get(package.name, [])
+
+            if package.installdir != 'mods':
+                # Only the mods directory is compared, others are checked by file
+                if os.path.isfile(self.profiledir + os.sep + package.installdir + os.sep + filename):
+                    unchanged += 1
                 else:
-                    shutil.copytree(tmppath + os.sep + path, savedir)
+                    added.append(package)
+                continue
+
+            others = [item for item in current if item[0] != 'mods/' + filename]
+            if not current:
+                added.append(package)
+            elif len(others) == len(current):
+                replaced.append((others.pop(0)[0], package))
+            else:
+                unchanged += 1
+            removed.extend(others)
+
+        for name in sorted(installed):
+            if name not in wanted:
+                removed.extend(installed[name])
+
+        return added, replaced, removed, unchanged
+
+    def display_sync_changes(self, added, replaced, removed, unchanged):
+        print(self.colortext(
+            "Sync: {} to install, {} to replace, {} to remove, {} unchanged".format(
+                len(added), len(replaced), len(removed), unchanged
+            ),
+            self.terminal.C_BLUE
+        ))
+        for package in added:
+            print(self.colortext("  + {}:{}".format(package.name, package.version), self.terminal.C_GREEN))
+        for path, package in replaced:
+            print(self.colortext("  ~ {} -> {}:{}".format(os.path.basename(path), package.name, package.version), self.terminal.C_YELLOW))
+        for path, package in removed:
+            print(self.colortext("  - {}:{}".format(package.name, package.version), self.terminal.C_RED))
 
     def do_uninstall(self, args):
         """Uninstall a package (mod)
@@ -425,12 +1190,21 @@ Example: creep uninstall thecricket/chisel2
 """
         package = self.repository.fetch_package(args)
         if not package:
-            print('Unknown package {}'.format(args))
+            self.display_unknown_package(args)
             return 1
 
         savedir = self.profiledir + os.sep + package.installdir
 
+        if not os.path.isfile(savedir + os.sep + package.get_local_filename()):
+            print(self.colortext("Mod '{0}' is not installed in '{1}'".format(package.name, savedir), self.terminal.C_RED))
+            return 1
+
         os.remove(savedir + os.sep + package.get_local_filename())
+
+        manifest = Manifest(savedir)
+        manifest.remove(package.get_local_filename())
+        manifest.save()
+
         print("Removed mod '{0}' from '{1}'".format(package.name, savedir))
 
     def do_stash(self, args):
@@ -463,6 +1237,8 @@ Use command `creep list installed` to see the list of currently installed mods
             print(self.colortext("Stash: Missing argument <subcommand>", self.terminal.C_RED))
             return 1
 
+        import argparse
+
         parser = argparse.ArgumentParser(add_help=False, prog='creep stash')
         parser.add_argument('subcommand')
         parser.add_argument('stash_name', nargs="?")
@@ -521,112 +1297,358 @@ Use command `creep list installed` to see the list of currently installed mods
         if not os.path.isdir(stashes_dir):
             os.mkdir(stashes_dir)
 
-        stash_dir = stashes_dir + os.sep + stash_name
+        stash = Stash(stashes_dir + os.sep + stash_name)
 
-        if os.path.exists(stash_dir):
+        if stash.exists():
             print(self.colortext("Stash with name {} already exists.".format(stash_name), self.terminal.C_RED))
             return 1
         else:
-            os.mkdir(stash_dir)
+            os.mkdir(stash.path)
 
-        # Collect everything from the mods dir and put it in the stash dir
+        # Put the whole mods dir in the stash dir
         installdir = self.profiledir + os.sep + 'mods'
-        packages = self.get_packages_in_dir(installdir)
+        files = Stash.list_files(installdir)
 
         print("Will stash the following files into stash {}:".format(stash_name))
-        files = sorted(packages.keys())
-
         for file in files:
             print(file)
-            from_ = installdir + os.sep + file
-            to_ = stash_dir + os.sep + file
-            shutil.move(from_, to_)
+
+        stash_dir = stash.path + os.sep + 'mods'
+        failed = set()
+        renamed = False
+        # Renaming a symbolic link would move the link rather than the mods,
+        # so its files are moved one by one and the link kept
+        if not os.path.islink(installdir):
+            try:
+                if os.path.isdir(installdir):
+                    os.rename(installdir, stash_dir)
+                else:
+                    os.mkdir(stash_dir)
+                renamed = True
+            except OSError:
+                # E.g. the mods dir is on another filesystem
+                pass
+        if not renamed:
+            os.makedirs(stash_dir, exist_ok=True)
+            failed = self.move_stash_files(installdir, stash_dir, files)
+        os.makedirs(installdir, exist_ok=True)
+
+        # Share the stashed files with the cache and other stashes
+        manifest = Manifest(stash_dir)
+        stash.files = {}
+        for file in files:
+            if file in failed:
+                continue
+            path = stash_dir + os.sep + file
+            try:
+                stat = os.stat(path)
+                entry = manifest.get(file, stat) or {}
+                digest = self.store.add_object(path, entry.get('sha256'))
+            except OSError as e:
+                print(self.colortext("Can't add '{}' to the stash: {}".format(file, e), self.terminal.C_RED))
+                continue
+            manifest.set_digest(file, digest, stat)
+            stash.files[file] = {'sha256': digest, 'size': stat.st_size}
+
+        manifest.save()
+        stash.save()
+        self.store.save()
+
+        if failed:
+            return 1
+
+    def move_stash_files(self, source, destination, files, copy_mode = False, objects = None):
+        """Move (or copy) mods between the mods dir and a stash, keeping their
+        manifest entries. Files missing from source are copied from the
+        objects given by hash, if any. Returns the names that failed."""
+        from . import fileops
+
+        source_manifest = Manifest(source)
+        destination_manifest = Manifest(destination)
+
+        pairs = []
+        copies = []
+        for file in files:
+            path = source + os.sep + file
+            if not os.path.lexists(path) and objects and objects.get(file):
+                copies.append((self.store.get_object_path(objects[file]), destination + os.sep + file))
+            elif copy_mode:
+                copies.append((path, destination + os.sep + file))
+            else:
+                pairs.append((path, destination + os.sep + file))
+
+        failed = self.report_failed_files(fileops.move_files(pairs))
+        failed |= self.report_failed_files(fileops.copy_files(copies))
+        for file in files:
+            if file not in failed:
+                destination_manifest.copy_entry(source_manifest, file)
+                if not copy_mode:
+                    source_manifest.remove(file)
+
+        destination_manifest.save()
+        source_manifest.save()
+
+        return failed
+
+    def report_failed_files(self, failed):
+        """Print the files that couldn't be copied or moved, and return
+        their names"""
+        names = set()
+        for source, destination, error in failed:
+            print(self.colortext("Can't copy '{}' to '{}': {}".format(source, destination, error), self.terminal.C_RED))
+            names.add(os.path.basename(destination))
+
+        return names
 
     def stash_info(self, stash_name):
-        stashes_dir = self.get_stashes_dir()
-        stash_dir = stashes_dir + os.sep + stash_name
+        stash = Stash(self.get_stashes_dir() + os.sep + stash_name)
 
-        if not os.path.isdir(stash_dir):
+        if not stash.exists():
             print(self.colortext("No stash with name {}".format(stash_name), self.terminal.C_RED))
             return 1
 
-        self.get_packages_in_dir(stash_dir, display_list = True, include_unknowns = True)
+        self.get_packages_in_dir(stash.get_files_dir(), display_list = True, include_unknowns = True)
         return 0
 
     def restore_stash(self, stash_name, copy_mode = False):
-        stashes_dir = self.get_stashes_dir()
-        stash_dir = stashes_dir + os.sep + stash_name
+        stash = Stash(self.get_stashes_dir() + os.sep + stash_name)
 
-        if not os.path.isdir(stash_dir):
+        if not stash.exists():
             print(self.colortext("No stash with name {}".format(stash_name), self.terminal.C_RED))
             return 1
 
-        # Collect everything from the stash dir and put it in the mods install dir
         installdir = self.profiledir + os.sep + 'mods'
-        packages = self.get_packages_in_dir(stash_dir)
-
-        files = sorted(packages.keys())
+        stash_dir = stash.get_files_dir()
+        files = sorted(stash.load())
 
         verb = "Applying" if copy_mode else "Moving"
-        print("{} files from stash {} to install dir.".format(verb, stash_dir))
+        print("{} files from stash {} to install dir.".format(verb, stash.path))
         for file in files:
             print(file)
-            from_ = stash_dir + os.sep + file
-            to_ = installdir + os.sep + file
-            if copy_mode:
-                shutil.copy(from_, to_)
+
+        # With nothing installed, the stashed mods dir is put back in one go,
+        # unless the mods dir is a symbolic link to keep
+        whole_dir = not copy_mode and not stash.is_legacy() and not Stash.list_files(installdir)
+        whole_dir = whole_dir and not os.path.islink(installdir)
+        if whole_dir and all(os.path.lexists(stash_dir + os.sep + file) for file in files):
+            try:
+                self.remove_empty_mods_dir(installdir)
+                os.rename(stash_dir, installdir)
+            except OSError:
+                os.makedirs(installdir, exist_ok=True)
             else:
-                shutil.move(from_, to_)
+                print("Deleting stash dir {}".format(stash_name))
+                shutil.rmtree(stash.path)
+                return 0
+
+        if not os.path.isdir(installdir):
+            os.makedirs(installdir)
+
+        # Stashed files are applied as hard links, sharing their bytes
+        objects = {file: entry.get('sha256') for file, entry in stash.files.items()}
+        failed = self.move_stash_files(stash_dir, installdir, files, copy_mode, objects)
+        if failed:
+            return 1
 
         if not copy_mode:
             # Delete the stash dir
             print("Deleting stash dir {}".format(stash_name))
-            shutil.rmtree(stash_dir)
+            shutil.rmtree(stash.path)
+
+    def remove_empty_mods_dir(self, installdir):
+        """Remove a mods dir that has no mods, only e.g. its manifest"""
+        if not os.path.isdir(installdir):
+            return
+
+        for name in os.listdir(installdir):
+            if name not in Stash.IGNORED_FILES:
+                raise OSError("'{}' is not empty".format(installdir))
+            os.remove(installdir + os.sep + name)
+
+        os.rmdir(installdir)
+
+    def count_purged_files(self, files):
+        """Count the purged files, leaving out the manifests creep keeps"""
+        return len([path for path, stat in files if os.path.basename(path) != Manifest.FILENAME])
 
     def do_purge(self, args):
         """Purge all installed packages (mods). Deletes all files from the mods directory.
 
-Usage: creep purge
+Usage: creep purge [--dry-run]
+  --dry-run               Only show how many files would be removed
+
+The mods directory is emptied right away (the old one is renamed aside), and
+the old files are then deleted in parallel.
 
 Use command `creep list installed` to see the list of currently installed mods
 """
+        args = shlex.split(args)
+
+        import argparse
+        from . import fileops
+
+        parser = argparse.ArgumentParser(add_help=False, prog='creep purge')
+        parser.add_argument('--dry-run', action='store_true')
+        pargs, _ = parser.parse_known_args(args)
+
         installdir = self.profiledir + os.sep + 'mods'
+        if not os.path.isdir(installdir):
+            print("Nothing to purge in {}".format(installdir))
+            return 0
+
+        if pargs.dry_run:
+            files, dirs, failed = fileops.scan_tree(installdir)
+            print("Would remove {} file(s) from {}, freeing {}.".format(
+                self.count_purged_files(files), installdir, self.format_size(fileops.get_freed_size(files))
+            ))
+            return 0
+
         print("Purging all installed mods in {}...".format(installdir))
-        self.delete_path(installdir)
-        print("Done.")
+
+        # Leftovers of an interrupted purge, unless that purge is still running
+        purge_prefix = os.path.basename(installdir) + '.creep-purge-'
+        trees = []
+        for name in os.listdir(self.profiledir):
+            pid = name[len(purge_prefix):]
+            if name.startswith(purge_prefix) and pid.isdigit() and not self.is_process_running(int(pid)):
+                trees.append(self.profiledir + os.sep + name)
+
+        if os.path.islink(installdir):
+            # Renaming would move the link, empty the directory it points to
+            trees.append(os.path.realpath(installdir))
+            keep_root = True
+        else:
+            trash_dir = installdir + '.creep-purge-' + str(os.getpid())
+            try:
+                os.rename(installdir, trash_dir)
+            except OSError:
+                # Can't move it aside, empty it in place
+                trees.append(installdir)
+                keep_root = True
+            else:
+                os.makedirs(installdir, exist_ok=True)
+                trees.append(trash_dir)
+                keep_root = False
+
+        removed = []
+        failed = []
+        for tree in trees:
+            if os.path.islink(tree):
+                # A link moved aside by an older version, not what it points to
+                os.remove(tree)
+                continue
+            tree_removed, tree_failed = fileops.delete_tree(tree, keep_root=keep_root and tree == trees[-1])
+            removed.extend(tree_removed)
+            failed.extend(tree_failed)
+
+        for path, error in failed:
+            print(self.colortext("Can't remove '{}': {}".format(path, error), self.terminal.C_RED))
+
+        print(self.colortext(
+            "Removed {} file(s), freed {}.".format(self.count_purged_files(removed), self.format_size(fileops.get_freed_size(removed))),
+            self.terminal.C_GREEN
+        ))
+
+        if failed:
+            print(self.colortext("{} file(s) couldn't be removed.".format(len(failed)), self.terminal.C_RED))
+            return 1
+
+        return 0
+
+    def is_process_running(self, pid):
+        """Check whether a process exists; assumed so where it can't be checked"""
+        if os.name == 'nt':
+            # os.kill() would send a CTRL_C_EVENT instead of checking
+            return True
+
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            # e.g. another user's process
+            return True
+
+        return True
+
+    def do_daemon(self, args):
+        """Keep the package repository loaded to answer commands quickly
+
+Usage: creep daemon [start|stop|status]
+
+Runs in the foreground until stopped (start it in the background with
+`creep daemon &`). While it is running, the commands info, search and list
+are answered by the daemon instead of loading the repository every time.
+It loads the repository again when the registry files or options change.
+Set CREEP_NO_DAEMON=1 to run commands without the daemon.
+"""
+        import socket # Low-level networking interface
+        from .daemon import Daemon, send_request
+
+        if not hasattr(socket, 'AF_UNIX'):
+            print(self.colortext("The daemon needs Unix domain sockets, which aren't available on this platform", self.terminal.C_RED))
+            return 1
+
+        daemon = Daemon(self)
+        subcommand = args.strip() or 'start'
+
+        if subcommand in ['stop', 'status']:
+            response = send_request(daemon.socket_path, {'action': subcommand})
+            if response is None:
+                print("Daemon not running.")
+                return 1 if subcommand == 'status' else 0
+            sys.stdout.write(response['output'])
+            return response['status']
+
+        if subcommand != 'start':
+            print(self.colortext("Daemon: Invalid subcommand {}".format(subcommand), self.terminal.C_RED))
+            return 1
+
+        if daemon.is_running():
+            print("Daemon already running.")
+            return 1
+
+        print("Daemon listening on {}".format(daemon.socket_path))
+        try:
+            daemon.serve()
+        except KeyboardInterrupt:
+            pass
+
+        return 0
 
     def do_refresh(self, args):
         """Force an refresh of the package repository"""
 
-        self.repository.clear_cache()
-        self.repository.populate()
+        # Revalidate even if the local registry isn't stale yet. Only what
+        # changed is downloaded when the server supports it.
+        self.create_repository(refresh=True)
         print(self.colortext("Repository updated to version {} ({}).".format(self.repository.version_hash, self.repository.version_date), self.terminal.C_GREEN))
         print("Count: {} packages.".format(self.repository.count_packages()))
 
-    def delete_path(self, rootdir):
-        files = os.listdir(rootdir)
-        for f in files:
-            if os.path.isdir(rootdir + os.sep + f):
-                self.delete_path(rootdir + os.sep + f)
-                os.rmdir(rootdir + os.sep + f)
-            else:
-                print(self.colortext('Removing file {}'.format(f), self.terminal.C_RED))
-                try:
-                    os.remove(rootdir + os.sep + f)
-                except OSError:
-                    print('opa')
-                    continue
+    def create_repository(self, refresh=False):
+        if self.repository_backend == 'sqlite':
+            # Indexed on-disk storage for large registries
+            from .sqliterepository import SqliteRepository
+            repository = SqliteRepository(self.appdir)
+        else:
+            repository = Repository(self.appdir)
+        repository.set_minecraft_target(self.minecraft_target)
 
-    def create_repository(self):
-        self.repository = Repository(self.appdir)
-        self.repository.set_minecraft_target(self.minecraft_target)
+        if self.repository_url:
+            repository.remote_url = self.repository_url
+        repository.background_refresh = self.background_refresh
+
+        if refresh:
+            repository.update_repository(force=True)
 
         # Check if local packages repository exists and load it too
         if os.path.isfile(self.appdir + os.sep + 'local-packages.json'):
-            self.repository.populate('', False)
-            self.repository.populate(self.appdir + os.sep + 'local-packages.json')
+            repository.populate('', False)
+            repository.populate(self.appdir + os.sep + 'local-packages.json')
         else:
-            self.repository.populate('', True)
+            repository.populate('', True)
+
+        self._repository = repository
 
     def update_paths(self):
         #self.installdir = os.path.dirname(os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))))
@@ -665,8 +1687,9 @@ Use command `creep list installed` to see the list of currently installed mods
 
     def update_version_with_git_describe(self):
         """Update the version of this client to reflect any local changes in git"""
+        import subprocess # Spawn subprocesses, connect in/out pipes, obtain return codes
 
-        appdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+        appdir = os.path.dirname(os.path.abspath(__file__))
 
         try:
             self.VERSION = subprocess.check_output(['git', '-C', appdir, 'describe'], stderr=subprocess.STDOUT).strip().decode("utf-8")
@@ -708,6 +1731,3 @@ Use command `creep list installed` to see the list of currently installed mods
     def colorend(self):
         return self.terminal.op()
 
-    def unzip(self, source_filename, dest_dir):
-        with zipfile.ZipFile(source_filename) as zf:
-            zf.extractall(dest_dir)
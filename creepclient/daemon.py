@@ -0,0 +1,217 @@
+"""Daemon that keeps a client and its repository loaded between commands
+
+Started with `creep daemon`. It listens on a Unix socket in the app dir
+(~/.creep/creep.sock) and the `creep` entry script sends query commands to
+it when it is running, so they don't pay for loading the registry each time.
+Requests and responses are a line of JSON each.
+"""
+
+import contextlib # Utilities for with-statement contexts
+import io # Core tools for working with streams
+import json # JSON encoder and decoder
+import os # Miscellaneous operating system interfaces
+import socket # Low-level networking interface
+import sys # System specific parameters and functions
+import time # Time access and conversions
+
+# Commands the daemon answers. Other commands change the profile or show
+# progress while they run, so they always run in the calling process.
+DAEMON_COMMANDS = ['info', 'search', 'list']
+
+# Files that make the daemon reload the options and repository when changed
+WATCHED_FILES = ['options.json', 'packages.json', 'local-packages.json']
+
+# Seconds the daemon waits for a client to send its request or take its
+# response, so a stuck client doesn't keep the others waiting
+CLIENT_TIMEOUT = 5
+
+# Seconds a client waits for the daemon to answer before running the command
+# itself, so a stuck daemon doesn't hang every call
+REQUEST_TIMEOUT = 30
+
+
+def get_socket_path(appdir):
+    return appdir + os.sep + 'creep.sock'
+
+
+def read_message(conn):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+
+    return json.loads(data.decode('utf-8'))
+
+
+def send_request(socket_path, request):
+    """Send a request to the daemon, returns None if no daemon is listening"""
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return None
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(REQUEST_TIMEOUT)
+    try:
+        conn.connect(socket_path)
+        conn.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        return read_message(conn)
+    except (OSError, ValueError):
+        return None
+    finally:
+        conn.close()
+
+
+def run_command(args):
+    """Run a command in the daemon if it is running and answers the command
+
+    Returns the exit status of the command, or None if it should be run in
+    this process instead. Set CREEP_NO_DAEMON to never use the daemon.
+    """
+    if not args or args[0] not in DAEMON_COMMANDS or os.getenv('CREEP_NO_DAEMON'):
+        return None
+
+    home = os.getenv('HOME') or os.getenv('USERPROFILE')
+    response = send_request(get_socket_path(home + os.sep + '.creep'), {
+        'action': 'command',
+        'command': ' '.join(args),
+        'cwd': os.getcwd(),
+        'isatty': sys.stdout.isatty(),
+    })
+    if response is None:
+        return None
+
+    sys.stdout.write(response['output'])
+    return response['status']
+
+
+class Daemon(object):
+    """Serve commands with a resident client, one at a time
+
+    Commands change the working directory and capture stdout, which are
+    shared by the whole process, so they aren't run in parallel. Instead a
+    client that stops sending or receiving is dropped after CLIENT_TIMEOUT.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.socket_path = get_socket_path(client.appdir)
+
+        # State of the watched files when the repository was loaded
+        self.signature = None
+        self.loaded_at = 0
+
+        self.running = False
+
+    def is_running(self):
+        return send_request(self.socket_path, {'action': 'status'}) is not None
+
+    def serve(self):
+        if os.path.exists(self.socket_path):
+            # Left behind by a daemon that didn't shut down cleanly
+            os.remove(self.socket_path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Only this user may talk to the daemon
+        umask = os.umask(0o077)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        server.listen(16)
+
+        self.reload()
+        self.running = True
+        try:
+            while self.running:
+                conn, _ = server.accept()
+                with conn:
+                    conn.settimeout(CLIENT_TIMEOUT)
+                    try:
+                        self.handle(conn)
+                    except Exception as e:
+                        # A bad request or registry file fails the request,
+                        # not the daemon
+                        self.respond(conn, {'status': 1, 'output': "Error: {}\n".format(e)})
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def handle(self, conn):
+        try:
+            request = read_message(conn)
+        except (OSError, ValueError):
+            return
+
+        if not isinstance(request, dict):
+            self.respond(conn, {'status': 1, 'output': "Error: Invalid request\n"})
+            return
+
+        action = request.get('action')
+        if action == 'command':
+            response = self.run(request)
+        elif action == 'stop':
+            self.running = False
+            response = {'status': 0, 'output': "Daemon stopped.\n"}
+        else:
+            response = {
+                'status': 0,
+                'output': "Daemon running (pid {}), serving {} packages.\n".format(
+                    os.getpid(), self.client.repository.count_packages()
+                ),
+            }
+
+        self.respond(conn, response)
+
+    def respond(self, conn, response):
+        try:
+            conn.sendall(json.dumps(response).encode('utf-8') + b'\n')
+        except OSError:
+            pass
+
+    def run(self, request):
+        """Run a command, capturing what it prints"""
+        output = io.StringIO()
+        cwd = os.getcwd()
+        self.client.terminal.isatty = bool(request.get('isatty'))
+        try:
+            os.chdir(request.get('cwd') or cwd)
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                self.reload_if_changed()
+                status = self.client.onecmd(request['command'])
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            output.write("Error: {}\n".format(e))
+            status = 1
+        finally:
+            os.chdir(cwd)
+
+        return {'status': status or 0, 'output': output.getvalue()}
+
+    def get_signature(self):
+        signature = []
+        for name in WATCHED_FILES:
+            try:
+                stat = os.stat(self.client.appdir + os.sep + name)
+                signature.append((name, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                signature.append((name, None, None))
+
+        return signature
+
+    def reload_if_changed(self):
+        """Reload when a watched file changed or the registry is due a refresh"""
+        stale = self.loaded_at + self.client.repository.cache_life < time.time()
+        if stale or self.get_signature() != self.signature:
+            self.reload()
+
+    def reload(self):
+        self.client.reload()
+
+        # Loading may refresh the registry file, so take the signature after
+        self.client.repository
+        self.signature = self.get_signature()
+        self.loaded_at = time.time()
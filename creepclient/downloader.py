@@ -0,0 +1,108 @@
+"""Concurrent downloader for package artifacts"""
+
+import http.client # HTTP protocol client
+import os # Miscellaneous operating system interfaces
+import threading # Thread-based parallelism
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+class Downloader(object):
+    """Download a batch of packages using a bounded pool of worker threads
+
+    The number of downloads in flight is limited globally by `workers` and
+    for each remote host by `per_host`, so a large list of mods hosted on the
+    same server doesn't hammer it with every request at once.
+    """
+
+    # Maximum number of simultaneous downloads
+    workers = 8
+
+    # Maximum number of simultaneous downloads from a single host
+    per_host = 4
+
+    def __init__(self, workers=None, per_host=None, on_complete=None, store=None, timeout=None):
+        if workers:
+            self.workers = max(1, int(workers))
+        if per_host:
+            self.per_host = max(1, int(per_host))
+
+        # Called as on_complete(package, result, completed, total) after each
+        # download, one call at a time so output lines don't interleave
+        self.on_complete = on_complete
+
+        # Artifact store that verifies and keeps the downloaded files
+        self.store = store
+
+        # Seconds a download waits for its server, see Package.download
+        self.timeout = timeout
+        self.output_lock = threading.Lock()
+        self.host_locks = {}
+        self.host_locks_lock = threading.Lock()
+
+    def download_all(self, jobs):
+        """Download all the given jobs
+
+        `jobs` is a list of (package, cachedir) tuples. Jobs that point at the
+        same local file are only downloaded once. Returns a list of the
+        packages that failed to download.
+        """
+        unique_jobs = {}
+        for package, cachedir in jobs:
+            path = cachedir + os.sep + package.get_local_filename()
+            if path not in unique_jobs:
+                unique_jobs[path] = (package, cachedir)
+
+        if not unique_jobs:
+            return []
+
+        self.total = len(unique_jobs)
+        self.completed = 0
+        failed = []
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, self.total)) as executor:
+            futures = {}
+            for package, cachedir in unique_jobs.values():
+                futures[executor.submit(self.download_one, package, cachedir)] = package
+
+            for future, package in futures.items():
+                if not future.result():
+                    failed.append(package)
+
+        return failed
+
+    def download_one(self, package, cachedir):
+        """Download a single package, honoring the per-host limit
+
+        Errors only fail this package, not the whole batch.
+        """
+        location = package.get_download_location()
+
+        try:
+            with self.get_host_lock(location):
+                result = package.download(cachedir, self.timeout)
+
+            if result and self.store:
+                path = cachedir + os.sep + package.get_local_filename()
+                result = bool(self.store.add_file(path, package.sha256))
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            # e.g. a socket timeout, a dropped connection or an invalid URL
+            print("Unable to download file ({}). Attempted to download '{}'".format(str(e) or type(e).__name__, location))
+            result = False
+
+        with self.output_lock:
+            self.completed += 1
+            if self.on_complete:
+                self.on_complete(package, result, self.completed, self.total)
+
+        return result
+
+    def get_host_lock(self, location):
+        """Get the semaphore that limits concurrent requests to a host"""
+        host = urlparse(location).netloc
+
+        with self.host_locks_lock:
+            if host not in self.host_locks:
+                self.host_locks[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_locks[host]
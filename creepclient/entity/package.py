@@ -2,13 +2,18 @@
 
 import creepclient
 import os
-import urllib.request
-import urllib.error
+import re
 
 from creepclient.entity import Entity
 
 class Package(Entity):
 
+    # Size of the chunks a download is streamed in
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+    # Seconds a download waits for the server before giving up
+    DOWNLOAD_TIMEOUT = 30
+
     def __init__(self, data = {}, **kwargs):
         self.name = ''
         self.version = ''
@@ -22,13 +27,30 @@ class Package(Entity):
         self.type = 'mod'
         self.installdir = 'mods'
         self.installstrategy = ''
+        self.sha256 = ''
 
         super(Package, self).__init__(data, **kwargs)
 
-    def download(self, savelocation):
-        """Download this package from the specified URL in the package"""
+    def download(self, savelocation, timeout=None):
+        """Download this package from the specified URL in the package
+
+        The file is streamed into a `.part` file that is renamed into place
+        once complete, so an interrupted download never looks like a cached
+        file. A later download resumes a partial file with a Range request.
+        A server that stalls for `timeout` seconds interrupts the download.
+        """
+
+        import http.client
+        import urllib.request
+        import urllib.error
 
         url = self.get_download_location()
+        path = savelocation + os.sep + self.get_local_filename()
+        partial_path = path + '.part'
+
+        offset = 0
+        if os.path.isfile(partial_path):
+            offset = os.path.getsize(partial_path)
 
         # Using these specific headers to make the request seem like a browser.
         # The old curseforge is using cloudflare to prevent bots
@@ -39,21 +61,64 @@ class Package(Entity):
             "Upgrade-Insecure-Requests": "1",
             "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/78.0.3904.87 Safari/537.36",
         }
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+
         request = urllib.request.Request(url, headers=headers)
         try:
-            response = urllib.request.urlopen(request)
-        except urllib.error.URLError as e:
+            response = urllib.request.urlopen(request, None, timeout or self.DOWNLOAD_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and offset:
+                # The partial file doesn't match the remote file, start over
+                os.remove(partial_path)
+                return self.download(savelocation, timeout)
+            print("Unable to download file (HTTP {}). Attempted to download '{}'".format(e.code, url))
+            return False
+        except (urllib.error.URLError, OSError) as e:
+            # OSError: e.g. timed out waiting for the response headers
             print("No internet connection or unable to download file. Attempted to download '" + self.get_download_location() + "'")
             return False
 
-        data = response.read()
+        if response.status == 206 and not self.get_range_start(response) == offset:
+            print("Unexpected partial response. Attempted to download '" + url + "'")
+            return False
+
+        if response.status != 206:
+            # Server sent the whole file
+            offset = 0
+
+        expected_size = None
+        if response.headers.get('Content-Length'):
+            expected_size = offset + int(response.headers['Content-Length'])
+
+        try:
+            with open(partial_path, 'ab' if offset else 'wb') as f:
+                while True:
+                    chunk = response.read(self.DOWNLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+        except (OSError, http.client.HTTPException):
+            # Keep the partial file so the download can be resumed later
+            print("Download interrupted. Attempted to download '" + url + "'")
+            return False
+        finally:
+            response.close()
+
+        if expected_size is not None and os.path.getsize(partial_path) != expected_size:
+            print("Download incomplete. Attempted to download '" + url + "'")
+            return False
 
-        f = open(savelocation + os.sep + self.get_local_filename(), 'wb')
-        f.write(data)
-        f.close()
+        os.replace(partial_path, path)
 
         return True
 
+    def get_range_start(self, response):
+        """Get the first byte position of a partial response"""
+        content_range = response.headers.get('Content-Range', '')
+        match = re.match(r'bytes (\d+)-', content_range)
+        return int(match.group(1)) if match else None
+
     def get_download_location(self):
         """Get the download location for this package"""
         if self.url:
@@ -0,0 +1,256 @@
+"""Copying and moving files without copying their bytes when possible"""
+
+import errno # Standard errno system symbols
+import os # Miscellaneous operating system interfaces
+import shutil # High-level file operations
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of files copied at the same time
+WORKERS = 8
+
+# Size of the chunks copied by copy_file_range and sendfile at a time
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# Errors meaning a way of copying isn't supported for these files
+UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EBADF, errno.EPERM)
+
+
+def copy_file(source, destination, link=True):
+    """Put a copy of source at destination, replacing it atomically
+
+    Tries, in order: a hard link (unless link is False), a reflink
+    (copy-on-write clone), copy_file_range, sendfile and only then a copy
+    through userspace. Returns the way the file was copied.
+    """
+    if os.path.isfile(destination) and os.path.samefile(source, destination):
+        # Renaming a link over the same file would do nothing
+        return 'same'
+
+    temp_path = destination + '.creep-tmp'
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+
+    try:
+        method = copy_to_new_file(source, temp_path, link)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return method
+
+
+def copy_to_new_file(source, destination, link=True):
+    if link:
+        try:
+            os.link(source, destination)
+            return 'link'
+        except OSError:
+            pass
+
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        if reflink(src, dst):
+            method = 'reflink'
+        elif copy_in_kernel(src, dst):
+            method = 'kernel'
+        else:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+            method = 'copy'
+
+    shutil.copystat(source, destination)
+    return method
+
+
+def reflink(src, dst):
+    """Clone a file with the FICLONE ioctl (Linux btrfs, xfs, ...)"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    FICLONE = 0x40049409
+    try:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        return False
+
+    return True
+
+
+def copy_in_kernel(src, dst):
+    """Copy with copy_file_range or sendfile, so the bytes don't go through
+    userspace. Returns False if neither works for these files."""
+    size = os.fstat(src.fileno()).st_size
+    for function in [getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)]:
+        if function is None:
+            continue
+
+        offset = 0
+        try:
+            while offset < size:
+                if function is os.sendfile:
+                    copied = function(dst.fileno(), src.fileno(), offset, min(CHUNK_SIZE, size - offset))
+                else:
+                    copied = function(src.fileno(), dst.fileno(), min(CHUNK_SIZE, size - offset))
+                if not copied:
+                    break
+                offset += copied
+        except OSError as e:
+            if e.errno not in UNSUPPORTED or offset:
+                raise
+            continue
+
+        if offset == size:
+            return True
+
+    # Start over from the beginning for a plain copy
+    src.seek(0)
+    dst.seek(0)
+    dst.truncate()
+    return False
+
+
+def move_file(source, destination):
+    """Move a file, by renaming it when both are on the same filesystem"""
+    try:
+        os.replace(source, destination)
+        return 'rename'
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    method = copy_file(source, destination, link=False)
+    os.remove(source)
+    return method
+
+
+def exchange(path, other):
+    """Swap two paths atomically with renameat2(RENAME_EXCHANGE)
+
+    Both keep existing all along: there's no moment where either is missing.
+    Returns False when the system or filesystem doesn't support it (it needs
+    Linux 3.15 and glibc 2.28).
+    """
+    try:
+        import ctypes
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (ImportError, OSError, AttributeError):
+        return False
+
+    AT_FDCWD = -100
+    RENAME_EXCHANGE = 2
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    if renameat2(AT_FDCWD, os.fsencode(path), AT_FDCWD, os.fsencode(other), RENAME_EXCHANGE) == 0:
+        return True
+
+    error = ctypes.get_errno()
+    if error in UNSUPPORTED:
+        return False
+    raise OSError(error, os.strerror(error), path, None, other)
+
+
+def run_all(function, pairs, workers=None):
+    """Run function(source, destination) for every pair, in parallel
+
+    Returns the (source, destination, error) of the pairs that failed.
+    """
+    failed = []
+    if len(pairs) < 2:
+        for source, destination in pairs:
+            try:
+                function(source, destination)
+            except OSError as e:
+                failed.append((source, destination, e))
+        return failed
+
+    with ThreadPoolExecutor(max_workers=workers or WORKERS) as executor:
+        futures = [(source, destination, executor.submit(function, source, destination)) for source, destination in pairs]
+        for source, destination, future in futures:
+            try:
+                future.result()
+            except OSError as e:
+                failed.append((source, destination, e))
+
+    return failed
+
+
+def copy_files(pairs, link=True, workers=None):
+    """Copy files in parallel, see copy_file"""
+    return run_all(lambda source, destination: copy_file(source, destination, link), pairs, workers)
+
+
+def move_files(pairs, workers=None):
+    """Move files in parallel, see move_file"""
+    return run_all(move_file, pairs, workers)
+
+
+def scan_tree(path):
+    """Find the files and directories of a directory tree with os.scandir,
+    without following symbolic links
+
+    Returns the files as (path, stat) pairs, the directories (parents before
+    their children) and the (path, error) of directories that can't be read.
+    """
+    files = []
+    dirs = []
+    failed = []
+
+    pending = [path]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                        pending.append(entry.path)
+                    else:
+                        files.append((entry.path, entry.stat(follow_symlinks=False)))
+        except OSError as e:
+            failed.append((directory, e))
+
+    return files, dirs, failed
+
+
+def get_freed_size(files):
+    """Get the bytes removing files would free, from their (path, stat)
+
+    Files with other hard links (e.g. to the cache) don't free their bytes.
+    """
+    return sum(stat.st_size for path, stat in files if stat.st_nlink <= 1)
+
+
+def delete_tree(path, keep_root=False, workers=None):
+    """Delete a directory tree, removing the files in parallel
+
+    Returns the files removed as (path, stat) pairs and the (path, error) of
+    what couldn't be removed.
+    """
+    files, dirs, failed = scan_tree(path)
+
+    def remove(item):
+        try:
+            os.remove(item[0])
+        except OSError as e:
+            return e
+        return None
+
+    removed = []
+    with ThreadPoolExecutor(max_workers=workers or WORKERS) as executor:
+        for item, error in zip(files, executor.map(remove, files)):
+            if error:
+                failed.append((item[0], error))
+            else:
+                removed.append(item)
+
+    for directory in reversed(([] if keep_root else [path]) + dirs):
+        try:
+            os.rmdir(directory)
+        except OSError as e:
+            # Not empty because of files that couldn't be removed
+            if not failed or e.errno != errno.ENOTEMPTY:
+                failed.append((directory, e))
+
+    return removed, failed
@@ -0,0 +1,203 @@
+"""Read the mod metadata embedded in jar files"""
+
+import json # JSON encoder and decoder
+import os # Miscellaneous operating system interfaces
+import re # Regular expressions
+import threading # Thread-based parallelism
+import zipfile # Zip file utilities
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Largest metadata member that will be read, anything bigger isn't metadata
+MAX_MEMBER_SIZE = 1024 * 1024
+
+
+def read_member(archive, name):
+    """Read a small member of an archive, None if it isn't there"""
+    try:
+        info = archive.getinfo(name)
+    except KeyError:
+        return None
+
+    if info.file_size > MAX_MEMBER_SIZE:
+        return None
+
+    return archive.read(info).decode('utf-8', 'replace')
+
+
+def parse_mods_toml(text, archive):
+    """Parse META-INF/mods.toml (Forge)"""
+    try:
+        import tomllib
+        data = tomllib.loads(text)
+        mod = (data.get('mods') or [{}])[0]
+    except (ImportError, ValueError):
+        # No TOML parser (before Python 3.11) or invalid file, the few keys
+        # needed are simple enough to find
+        mod = {}
+        for key in ['modId', 'version', 'displayName']:
+            match = re.search(r'^\s*' + key + r'\s*=\s*"([^"]*)"', text, re.MULTILINE)
+            if match:
+                mod[key] = match.group(1)
+
+    if not mod.get('modId'):
+        return None
+
+    version = mod.get('version', '')
+    if version.startswith('${'):
+        # Filled in from the jar manifest when the mod was built
+        version = read_manifest_version(archive) or ''
+
+    return {
+        'modid': mod['modId'],
+        'name': mod.get('displayName', ''),
+        'version': version,
+        'loader': 'forge',
+    }
+
+
+def read_manifest_version(archive):
+    text = read_member(archive, 'META-INF/MANIFEST.MF')
+    if text:
+        match = re.search(r'^Implementation-Version:\s*(\S+)', text, re.MULTILINE)
+        if match:
+            return match.group(1)
+
+    return None
+
+
+def parse_mcmod_info(text, archive):
+    """Parse mcmod.info (older Forge)"""
+    data = json.loads(text, strict=False)
+    if isinstance(data, dict):
+        data = data.get('modList') or data.get('modlist') or []
+    if not data or not data[0].get('modid'):
+        return None
+
+    mod = data[0]
+    return {
+        'modid': mod['modid'],
+        'name': mod.get('name', ''),
+        'version': mod.get('version', ''),
+        'loader': 'forge',
+    }
+
+
+def parse_fabric_mod_json(text, archive):
+    """Parse fabric.mod.json (Fabric)"""
+    mod = json.loads(text, strict=False)
+    if not mod.get('id'):
+        return None
+
+    return {
+        'modid': mod['id'],
+        'name': mod.get('name', ''),
+        'version': mod.get('version', ''),
+        'loader': 'fabric',
+    }
+
+
+# Metadata members and their parsers, in order of preference
+METADATA_FILES = [
+    ('META-INF/mods.toml', parse_mods_toml),
+    ('fabric.mod.json', parse_fabric_mod_json),
+    ('mcmod.info', parse_mcmod_info),
+]
+
+
+def read_metadata(path):
+    """Read the mod metadata of a jar file, None if it has none
+
+    Only the zip central directory (at the end of the file) and the metadata
+    member are read, never the whole file.
+    """
+    try:
+        with open(path, 'rb') as fp, zipfile.ZipFile(fp) as archive:
+            for name, parse in METADATA_FILES:
+                text = read_member(archive, name)
+                if text is None:
+                    continue
+                try:
+                    metadata = parse(text, archive)
+                except (ValueError, TypeError, AttributeError, IndexError):
+                    continue
+                if metadata:
+                    return metadata
+    except (OSError, zipfile.BadZipFile, RuntimeError):
+        # RuntimeError: encrypted member
+        pass
+
+    return None
+
+
+class JarInfo(object):
+    """Reader of jar metadata with a cache keyed by file size, mtime and inode"""
+
+    # Number of jars read at the same time
+    workers = 8
+
+    # Number of cached results kept, the oldest are dropped first
+    max_entries = 10000
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.cache = None
+        self.changed = False
+        self.lock = threading.Lock()
+
+    def load_cache(self):
+        if self.cache is not None:
+            return self.cache
+
+        try:
+            with open(self.cache_path) as fp:
+                self.cache = json.load(fp)
+        except (OSError, ValueError):
+            self.cache = {}
+
+        return self.cache
+
+    def save(self):
+        if not self.changed:
+            return
+
+        for key in list(self.cache)[:-self.max_entries]:
+            del self.cache[key]
+
+        temp_path = "{}.{}.tmp".format(self.cache_path, os.getpid())
+        with open(temp_path, 'w') as fp:
+            json.dump(self.cache, fp)
+        os.replace(temp_path, self.cache_path)
+        self.changed = False
+
+    def get_key(self, path):
+        stat = os.stat(path)
+        return "{}:{}:{}".format(stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def get_metadata(self, path):
+        try:
+            key = self.get_key(path)
+        except OSError:
+            return None
+
+        with self.lock:
+            cache = self.load_cache()
+            if key in cache:
+                return cache[key]
+
+        metadata = read_metadata(path)
+
+        with self.lock:
+            self.cache[key] = metadata
+            self.changed = True
+
+        return metadata
+
+    def get_all_metadata(self, paths):
+        """Read the metadata of many jars in parallel, by path"""
+        self.load_cache()
+        if len(paths) < 2:
+            return {path: self.get_metadata(path) for path in paths}
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return dict(zip(paths, executor.map(self.get_metadata, paths)))
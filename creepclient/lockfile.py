@@ -0,0 +1,105 @@
+"""Lockfile of resolved packages"""
+
+import json # JSON encoder and decoder
+import os # Miscellaneous operating system interfaces
+
+from .entity.package import Package
+
+
+class LockfileError(Exception):
+    """Raised when a lockfile can't be read"""
+    pass
+
+
+class Lockfile(object):
+    """Exact packages to install, as resolved at the time of locking
+
+    For each package in the dependency closure it records the version, the
+    download URL, the local filename and the SHA-256 of the artifact, so the
+    same files can be installed later without the registry.
+    """
+
+    DEFAULT_NAME = 'creep.lock'
+
+    # Version of the lockfile format
+    lockfile_format = 1
+
+    def __init__(self, minecraft_target='', packages=None, digests=None):
+        self.minecraft_target = minecraft_target
+        self.packages = packages or []
+
+        # Hashes of the packages the registry has none for, by package name,
+        # so the (shared) package entities aren't changed
+        self.digests = digests or {}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as fp:
+                data = json.load(fp)
+        except (OSError, ValueError) as e:
+            raise LockfileError("Can't read lockfile '{}': {}".format(path, e))
+
+        if data.get('lockfile_format') != cls.lockfile_format:
+            raise LockfileError("Unsupported lockfile format in '{}'".format(path))
+
+        packages = [cls.create_package(entry) for entry in data['packages']]
+        return cls(data.get('minecraft_target', ''), packages)
+
+    @classmethod
+    def create_package(cls, entry):
+        package = Package()
+        package.name = entry['name']
+        package.version = entry['version']
+        package.type = entry.get('type', 'mod')
+        package.description = entry.get('description', '')
+        package.require = {'minecraft': entry.get('minecraft', '')}
+        package.url = entry.get('url', '')
+        package.filename = entry.get('filename', '')
+        package.installdir = entry.get('installdir', 'mods')
+        package.installstrategy = entry.get('installstrategy', '')
+        package.sha256 = entry.get('sha256', '')
+
+        return package
+
+    def save(self, path):
+        data = {
+            'lockfile_format': self.lockfile_format,
+            'minecraft_target': self.minecraft_target,
+            'packages': [self.get_entry(package) for package in self.packages],
+        }
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as fp:
+            json.dump(data, fp, indent=2)
+            fp.write('\n')
+        os.replace(temp_path, path)
+
+    def get_entry(self, package):
+        entry = {
+            'name': package.name,
+            'version': package.version,
+            'type': package.type,
+            # For the manifest of the installed files, without the registry
+            'description': package.description,
+            'minecraft': package.require.get('minecraft', ''),
+        }
+        if package.type != 'collection':
+            entry['url'] = package.get_download_location()
+            entry['filename'] = package.filename
+            entry['local_filename'] = package.get_local_filename()
+            entry['installdir'] = package.installdir
+            entry['sha256'] = self.digests.get(package.name) or package.sha256
+        if package.installstrategy:
+            entry['installstrategy'] = package.installstrategy
+
+        return entry
+
+    @classmethod
+    def is_lockfile(cls, path):
+        """Check whether a file is a lockfile rather than a listfile"""
+        try:
+            with open(path) as fp:
+                return fp.read(1) == '{'
+        except OSError:
+            return False
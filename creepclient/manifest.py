@@ -0,0 +1,145 @@
+"""Manifest of the packages installed in a directory"""
+
+import json # JSON encoder and decoder
+import os # Miscellaneous operating system interfaces
+
+from .entity.package import Package
+
+
+class Manifest(object):
+    """Record of which package each file in a directory belongs to
+
+    Kept in the directory itself (e.g. mods/.creep-manifest.json). An entry
+    is trusted as long as the size and modification time of its file are
+    unchanged, so listing a directory doesn't need the registry. Files the
+    registry doesn't know are recorded too, without a package name, along
+    with the registry version they were checked against.
+    """
+
+    FILENAME = '.creep-manifest.json'
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = directory + os.sep + self.FILENAME
+        self.entries = None
+        self.changed = False
+
+    def load(self):
+        if self.entries is not None:
+            return self.entries
+
+        try:
+            with open(self.path) as fp:
+                self.entries = json.load(fp)
+        except (OSError, ValueError):
+            self.entries = {}
+
+        return self.entries
+
+    def save(self):
+        if not self.changed:
+            return
+
+        # Replace rather than write over it, since the file can be a hard
+        # link shared with a staging directory
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as fp:
+            json.dump(self.entries, fp)
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+    def get(self, filename, stat):
+        """Get the entry of a file, if its size and modification time match"""
+        entry = self.load().get(filename)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry
+
+        return None
+
+    def add(self, filename, package=None, sha256=None, metadata=None, registry_version=None):
+        """Record the package a file belongs to
+
+        For a file that isn't a known package, pass None as the package, the
+        metadata read from the file, if any, and the version of the registry
+        it isn't in.
+        """
+        try:
+            stat = os.stat(self.directory + os.sep + filename)
+        except OSError:
+            return
+
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        if package:
+            entry.update({
+                'name': package.name,
+                'version': package.version,
+                'description': package.description,
+                'minecraft': package.require.get('minecraft', ''),
+                'type': package.type,
+                'sha256': sha256 or package.sha256,
+            })
+        else:
+            # Already checked for embedded metadata, no need to do it again
+            # until the registry changes
+            entry['checked'] = registry_version
+            if metadata:
+                entry['metadata'] = metadata
+
+        self.load()[filename] = entry
+        self.changed = True
+
+    def copy_entry(self, manifest, filename):
+        """Record a file copied or moved from a directory with another manifest"""
+        entry = manifest.load().get(filename)
+        if entry is None:
+            return
+
+        try:
+            stat = os.stat(self.directory + os.sep + filename)
+        except OSError:
+            return
+
+        entry = dict(entry, size=stat.st_size, mtime=stat.st_mtime_ns)
+        self.load()[filename] = entry
+        self.changed = True
+
+    def set_digest(self, filename, sha256, stat):
+        """Record the hash of a file, e.g. once it was hashed for a stash
+
+        Pass the stat of the file from before it was hashed (and possibly
+        replaced with a link to the same bytes); its entry is kept only if it
+        matched that.
+        """
+        entry = self.get(filename, stat) or {}
+        try:
+            stat = os.stat(self.directory + os.sep + filename)
+        except OSError:
+            return
+
+        self.load()[filename] = dict(entry, size=stat.st_size, mtime=stat.st_mtime_ns, sha256=sha256)
+        self.changed = True
+
+    def remove(self, filename):
+        if self.load().pop(filename, None) is not None:
+            self.changed = True
+
+    def prune(self, filenames):
+        """Forget the files that are no longer in the directory"""
+        for filename in list(self.load()):
+            if filename not in filenames:
+                self.remove(filename)
+
+    def create_package(self, entry):
+        """Create a package entity from an entry, None for an unknown file"""
+        if not entry.get('name'):
+            return None
+
+        package = Package()
+        package.name = entry['name']
+        package.version = entry['version']
+        package.description = entry.get('description', '')
+        package.require = {'minecraft': entry.get('minecraft', '')}
+        package.type = entry.get('type', 'mod')
+        package.sha256 = entry.get('sha256', '')
+
+        return package
@@ -0,0 +1,30 @@
+"""Refresh the registry file in the background
+
+Started by Repository.start_background_refresh as
+`python -m creepclient.refresh <appdir> <remote_url>`
+"""
+
+import sys # System specific parameters and functions
+
+from .repository import Repository
+
+
+def main(argv):
+    if len(argv) < 3:
+        return 2
+
+    repository = Repository(argv[1])
+    repository.remote_url = argv[2]
+
+    if not repository.acquire_lock():
+        # Another process is refreshing it already
+        return 0
+
+    try:
+        return 0 if repository.download_remote_repository() else 1
+    finally:
+        repository.release_lock()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,13 +1,19 @@
 """Repository for packages"""
 
+import gc # Garbage collector interface
+import hashlib # Secure hashes and message digests
+import heapq # Heap queue algorithm
 import json # JSON encoder and decoder
 import os # Miscellaneous operating system interfaces
+import pickle # Python object serialization
 import re # Regular expressions
-import urllib.request
-import urllib.error
+import sys # System specific parameters and functions
+import time # Time access and conversions
 
+from functools import cmp_to_key
 from operator import attrgetter
 from .entity.package import Package
+from .search import SearchIndex, TrigramIndex
 
 
 def cmp(a, b):
@@ -28,6 +34,18 @@ class Repository(object):
     # Local registry cache lifetime in seconds
     cache_life = 3600
 
+    # Instance manipulation requested for registry deltas
+    delta_format = 'creep-delta'
+
+    # Whether a stale registry is used right away and refreshed in the background
+    background_refresh = False
+
+    # Seconds after which a refresh lock is considered abandoned
+    lock_life = 120
+
+    # Seconds to skip trying to refresh after the remote registry was unreachable
+    offline_life = 300
+
     # Has every package, including every version of each
     packages = []
 
@@ -37,59 +55,363 @@ class Repository(object):
     # Dict of all unique packages, by second name
     simple_name_packages = {}
 
+    # Dict of unique packages, by full name
+    name_index = {}
+
+    # Dict of every version of each package, by full name
+    versions_index = {}
+
+    # Dict of packages, by (full name, version)
+    version_index = {}
+
+    # Dict of packages, by (second name, version)
+    simple_version_index = {}
+
+    # Dict of packages, by both registry filename and local filename
+    filename_index = {}
+
+    # Full-text index of the unique packages
+    search_index = None
+
+    # Trigram index of the names of the unique packages
+    trigram_index = None
+
     # Currently targeted version of minecraft
     minecraft_target = "1.16.1"
 
+    # Registry files the packages are populated from
+    sources = []
+
+    # Format of the compiled snapshot, bump when the snapshot contents change
+    snapshot_format = 6
+
+    # Attributes that are saved in the compiled snapshot
+    snapshot_fields = [
+        'version_hash',
+        'version_date',
+        'packages',
+        'unique_packages',
+        'simple_name_packages',
+        'name_index',
+        'versions_index',
+        'version_index',
+        'simple_version_index',
+        'filename_index',
+        'search_index',
+        'trigram_index',
+    ]
+
     def __init__(self, appdir):
         self.localdir = appdir + os.sep + 'packages.json'
+        self.snapshot_path = appdir + os.sep + 'packages.snapshot'
+        self.meta_path = appdir + os.sep + 'packages.meta.json'
+        self.lock_path = appdir + os.sep + 'packages.lock'
+        self.offline_path = appdir + os.sep + 'packages.offline'
+
+        # Registry data of the packages changed by the last delta, by name
+        self.changed_packages = None
+        self.delta_base_version = None
+        self.delta_version = None
+
+        self.packages = []
+        self.unique_packages = []
+        self.simple_name_packages = {}
+        self.name_index = {}
+        self.versions_index = {}
+        self.version_index = {}
+        self.simple_version_index = {}
+        self.filename_index = {}
+        self.search_index = SearchIndex()
+        self.trigram_index = TrigramIndex()
+        self.sources = []
 
     def set_minecraft_target(self, target):
         self.minecraft_target = target
 
-    def download_remote_repository(self):
+    def download_remote_repository(self, conditional=True):
+        """Download the registry if it changed since the local copy
+
+        Sends the validators saved from the last download so the server can
+        answer 304 Not Modified, and asks for a delta (RFC 3229, with the
+        instance manipulation 'creep-delta') so that only the packages that
+        changed since the local version are transferred. Unless conditional,
+        the whole registry is requested. The local copy is only replaced
+        once a complete registry was received.
+        """
+        import urllib.request
+        import urllib.error
+
         print("Refreshing registry file from " + self.remote_url)
+
+        meta = self.read_meta()
+        headers = {}
+        if conditional and os.path.isfile(self.localdir):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+                if meta.get('repository_version'):
+                    headers['A-IM'] = self.delta_format
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        request = urllib.request.Request(self.remote_url, headers=headers)
         try:
-            response = urllib.request.urlopen(self.remote_url, None, self.timeout)
-        except urllib.error.URLError:
+            response = urllib.request.urlopen(request, None, self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                # Still fresh, just mark when it was last checked
+                os.utime(self.localdir, None)
+                return True
+            return False
+        except (urllib.error.URLError, OSError):
+            # Remember that the network is unreachable so the next runs
+            # don't each wait for the timeout
+            self.write_file(self.offline_path, b'')
             return False
 
-        data = response.read()
+        if os.path.isfile(self.offline_path):
+            os.remove(self.offline_path)
 
-        f = open(self.localdir, 'wb')
-        f.write(data)
-        f.close()
+        try:
+            data = response.read()
+        except OSError:
+            return False
+
+        if response.status == 226 and self.delta_format in response.headers.get('IM', ''):
+            if not self.apply_remote_delta(data, meta):
+                # Delta doesn't apply to the local copy, get the whole thing
+                # and keep the local copy until it's here
+                return self.download_remote_repository(conditional=False)
+        else:
+            try:
+                if not isinstance(json.loads(data.decode('utf-8')), dict):
+                    return False
+            except ValueError:
+                return False
+            self.write_file(self.localdir, data)
+            meta['repository_version'] = self.read_version(data)
+
+        meta['etag'] = response.headers.get('ETag', '')
+        meta['last_modified'] = response.headers.get('Last-Modified', '')
+        self.write_file(self.meta_path, json.dumps(meta).encode('utf-8'))
         return True
 
+    def apply_remote_delta(self, data, meta):
+        """Apply a registry delta to the local registry file
+
+        The delta lists, by package name, the versions that were added or
+        changed, with null for removed versions, or null for a removed
+        package:
+
+            {"base_version": "...", "repository_version": "...", "date": "...",
+             "packages": {"vendor/mod": {"1.2": {...}, "1.1": null}}}
+        """
+        try:
+            delta = json.loads(data.decode('utf-8'))
+        except ValueError:
+            return False
+        if not isinstance(delta, dict):
+            return False
+
+        registry = self.read_registry(self.localdir)
+        if delta.get('base_version') != registry.get('repository_version'):
+            return False
+
+        self.changed_packages = {}
+        for name, versions in delta.get('packages', {}).items():
+            if versions is None:
+                registry['packages'].pop(name, None)
+            else:
+                current = registry['packages'].setdefault(name, {})
+                for version, package_data in versions.items():
+                    if package_data is None:
+                        current.pop(version, None)
+                    else:
+                        current[version] = package_data
+                if not current:
+                    del registry['packages'][name]
+            self.changed_packages[name] = registry['packages'].get(name, {})
+
+        self.delta_base_version = registry.get('repository_version')
+        registry['repository_version'] = delta.get('repository_version', '')
+        registry['date'] = delta.get('date', registry.get('date', ''))
+        self.delta_version = (registry['repository_version'], registry['date'])
+
+        self.write_file(self.localdir, json.dumps(registry).encode('utf-8'))
+        meta['repository_version'] = registry['repository_version']
+        return True
+
+    def read_version(self, data):
+        """Get the repository version from the raw registry file contents"""
+        match = re.search(rb'"repository_version"\s*:\s*"([^"]*)"', data)
+        return match.group(1).decode('utf-8') if match else ''
+
+    def read_meta(self):
+        try:
+            with open(self.meta_path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def write_file(self, location, data):
+        """Write a file by swapping in a complete temp file"""
+        temp_path = "{}.{}.tmp".format(location, os.getpid())
+        with open(temp_path, 'wb') as fp:
+            fp.write(data)
+        os.replace(temp_path, location)
+
     def load_repository(self):
+        self.update_repository()
+        return self.read_registry(self.localdir)
+
+    def update_repository(self, force=False):
+        """Make sure the local registry file exists and is fresh
+
+        Unless forced, doesn't try again while the remote registry was
+        recently found unreachable. In background refresh mode a stale
+        registry is used as is while a detached process refreshes it.
+        """
+        if not force and self.is_offline():
+            if not os.path.isfile(self.localdir):
+                print("Package definition file not found or no internet connection.")
+            return
+
         # Repository file doesn't exist, fetch it from remote url
         if not os.path.isfile(self.localdir):
             if not self.download_remote_repository():
                 print("Package definition file not found or no internet connection.")
-                return {'packages': {}}
-            return json.load(open(self.localdir))
+            return
 
         # Check repository file date last modified
         # If it is older than specified time, redownload
-        import calendar
-        import time
         filetime = os.stat(self.localdir).st_mtime
-        if filetime + self.cache_life < calendar.timegm(time.gmtime()):
+        if not force and filetime + self.cache_life >= time.time():
+            return
+
+        if self.background_refresh and not force:
+            self.start_background_refresh()
+            return
+
+        if not self.acquire_lock():
+            # Another run is refreshing it already
+            return
+
+        try:
             if not self.download_remote_repository():
                 print("No internet connection. Using current version of repository. Date: {}".format(time.ctime(filetime)))
+        finally:
+            self.release_lock()
+
+    def is_offline(self):
+        """Check whether the remote registry was recently unreachable"""
+        try:
+            return os.stat(self.offline_path).st_mtime + self.offline_life > time.time()
+        except OSError:
+            return False
+
+    def acquire_lock(self):
+        """Take the lock for refreshing the registry file, if nobody has it"""
+        try:
+            fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if os.stat(self.lock_path).st_mtime + self.lock_life > time.time():
+                    return False
+                # Abandoned by a run that didn't finish
+                os.remove(self.lock_path)
+            except OSError:
+                return False
+            return self.acquire_lock()
+        except OSError:
+            return False
+
+        os.write(fd, str(os.getpid()).encode('utf-8'))
+        os.close(fd)
+        return True
 
-        return json.load(open(self.localdir))
+    def release_lock(self):
+        try:
+            os.remove(self.lock_path)
+        except OSError:
+            pass
+
+    def start_background_refresh(self):
+        """Refresh the registry file in a detached process"""
+        import subprocess # Spawn subprocesses, connect in/out pipes, obtain return codes
+
+        if os.path.exists(self.lock_path):
+            return
+
+        command = [
+            sys.executable, '-m', 'creepclient.refresh',
+            os.path.dirname(self.localdir), self.remote_url,
+        ]
+        options = {}
+        if sys.platform[:3] == 'win':
+            options['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            options['start_new_session'] = True
+
+        try:
+            subprocess.Popen(
+                command,
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                **options
+            )
+        except OSError:
+            pass
+
+    def read_registry(self, location):
+        if not os.path.isfile(location):
+            return {'packages': {}}
+
+        with open(location) as fp:
+            return json.load(fp)
 
     def clear_cache(self):
-        if os.path.isfile(self.localdir):
-            os.remove(self.localdir)
+        for location in [self.localdir, self.snapshot_path, self.meta_path]:
+            if os.path.isfile(location):
+                os.remove(location)
 
     def populate(self, location='', should_post_process=True):
+        """Add a registry file as a source of packages
+
+        Sources are read when post processing. When the compiled snapshot
+        of all the sources is up to date it is loaded instead of parsing
+        and indexing every registry file again.
+        """
         if not location:
-            registry = self.load_repository()
-        else:
-            # Assuming location is a path to an alternate file
-            registry = json.load(open(location))
+            self.update_repository()
+            location = self.localdir
+
+        # Assuming location is a path to an alternate file
+        self.sources.append(location)
 
+        if should_post_process:
+            self.load_sources()
+
+    def load_sources(self):
+        """Load the packages from all the sources"""
+        if self.load_snapshot():
+            return
+
+        if self.changed_packages is not None and self.load_snapshot(self.delta_base_version):
+            # Only re-create and re-index the packages changed by the delta
+            self.apply_changed_packages()
+            self.save_snapshot()
+            return
+
+        self.packages = []
+        for source in self.sources:
+            self.populate_from_registry(self.read_registry(source))
+
+        self.post_populate()
+        self.save_snapshot()
+
+    def populate_from_registry(self, registry):
+        """Create the package entities for a registry"""
         if 'repository_version' in registry:
             self.version_hash = registry['repository_version']
         if 'date' in registry:
@@ -98,31 +420,262 @@ class Repository(object):
         for namekey in registry['packages']:
             for versionkey in registry['packages'][namekey]:
                 data = registry['packages'][namekey][versionkey]
-                package = Package()
-                package.name = data['name']
-                package.version = data['version']
-                package.description = data['description']
-                package.keywords = data['keywords']
-                package.require = data['require']
-                package.filename = data['filename'] if 'filename' in data else ''
-                package.url = data['url'] if 'url' in data else ''
-                package.author = data['author']
-                package.homepage = data['homepage'] if 'homepage' in data else ''
-                package.type = data['type']
-                if 'installdir' in data:
-                    package.installdir = data['installdir']
-                if 'installstrategy' in data:
-                    package.installstrategy = data['installstrategy']
-                self.packages.append(package)
+                self.packages.append(self.create_package(data))
+
+    def create_package(self, data):
+        """Create a package entity from its registry data"""
+        package = Package()
+        package.name = data['name']
+        package.version = data['version']
+        package.description = data['description']
+        package.keywords = data['keywords']
+        package.require = data['require']
+        package.filename = data['filename'] if 'filename' in data else ''
+        package.url = data['url'] if 'url' in data else ''
+        package.author = data['author']
+        package.homepage = data['homepage'] if 'homepage' in data else ''
+        package.type = data['type']
+        if 'installdir' in data:
+            package.installdir = data['installdir']
+        if 'installstrategy' in data:
+            package.installstrategy = data['installstrategy']
+        if 'sha256' in data:
+            package.sha256 = data['sha256']
+
+        return package
+
+    def apply_changed_packages(self):
+        """Replace the packages changed by a delta with their new versions
+
+        The indexes are updated for the changed packages only, instead of
+        being built again from every package.
+        """
+        self.version_hash, self.version_date = self.delta_version
+
+        changed = set(self.changed_packages)
+        removed = [package for name in changed for package in self.versions_index.get(name, [])]
+        added = []
+        for name in sorted(changed):
+            for data in self.changed_packages[name].values():
+                added.append(self.create_package(data))
+
+        # Both lists are sorted by name and have no name in common
+        self.packages = list(heapq.merge(
+            [package for package in self.packages if package.name not in changed],
+            added,
+            key=attrgetter('name'),
+        ))
+
+        removed_unique = [self.name_index[name] for name in changed if name in self.name_index]
+        added_unique = [self.get_latest(versions) for versions in self.group_by_name(added).values()]
+        added_unique = [package for package in added_unique if package]
+        self.unique_packages = list(heapq.merge(
+            [package for package in self.unique_packages if package.name not in changed],
+            sorted(added_unique, key=attrgetter('name')),
+            key=attrgetter('name'),
+        ))
+
+        for package in removed_unique:
+            del self.name_index[package.name]
+        for package in added_unique:
+            self.name_index[package.name] = package
+
+        # Lists of latest packages by simple name, in name order
+        for simple_name in set(package.get_simple_name() for package in removed_unique + added_unique):
+            packages = [package for package in self.simple_name_packages.get(simple_name, []) if package.name not in changed]
+            packages.extend(package for package in added_unique if package.get_simple_name() == simple_name)
+            packages.sort(key=attrgetter('name'))
+            if packages:
+                self.simple_name_packages[simple_name] = packages
+            else:
+                self.simple_name_packages.pop(simple_name, None)
 
-        if should_post_process:
-            self.post_populate()
+        for name in changed:
+            self.versions_index.pop(name, None)
+        for name, versions in self.group_by_name(added).items():
+            self.versions_index[name] = versions
+
+        self.update_first_wins_index(self.version_index, lambda package: [(package.name, package.version)], removed, added)
+        self.update_first_wins_index(self.simple_version_index, lambda package: [(package.get_simple_name(), package.version)], removed, added)
+        self.update_first_wins_index(self.filename_index, self.get_filename_keys, removed, added)
+
+        self.search_index.update(removed_unique, added_unique)
+        self.trigram_index.update(removed_unique, added_unique)
+
+    def group_by_name(self, packages):
+        grouped = {}
+        for package in packages:
+            grouped.setdefault(package.name, []).append(package)
+
+        return grouped
+
+    def get_latest(self, versions):
+        """Get the latest of the versions of a package for the targeted
+        minecraft version, None if there is none"""
+        latest = None
+        for package in versions:
+            if package.get_minecraft_version() != self.minecraft_target:
+                continue
+            if latest is None or self.compare_versions(package.version, latest.version) > 0:
+                latest = package
+
+        return latest
+
+    def get_filename_keys(self, package):
+        keys = [package.get_local_filename()]
+        if package.filename:
+            keys.insert(0, package.filename)
+
+        return keys
+
+    def update_first_wins_index(self, index, get_keys, removed, added):
+        """Update an index where the first package, in name order, wins a key
+
+        Only when a removed package owned a key that no package of the same
+        name takes over are the other packages checked for one it shadowed.
+        """
+        orphaned = {}
+        for package in removed:
+            for key in get_keys(package):
+                if index.get(key) is package:
+                    del index[key]
+                    orphaned[key] = package.name
+
+        for package in added:
+            for key in get_keys(package):
+                current = index.get(key)
+                if current is None or package.name < current.name:
+                    index[key] = package
+                if orphaned.get(key) == package.name:
+                    del orphaned[key]
+
+        if not orphaned:
+            return
+
+        added_ids = set(id(package) for package in added)
+        for package in self.packages:
+            if id(package) in added_ids:
+                continue
+            for key in get_keys(package):
+                if key in orphaned:
+                    current = index.get(key)
+                    if current is None or package.name < current.name:
+                        index[key] = package
+
+    def get_snapshot_key(self):
+        """Get the key identifying the sources the snapshot was compiled from
+
+        Each source is identified by its size, mtime and a hash of its
+        contents. The hash is only computed when the size or mtime changed.
+        """
+        key = {
+            'format': self.snapshot_format,
+            'minecraft_target': self.minecraft_target,
+            'sources': [],
+        }
+        for source in self.sources:
+            try:
+                stat = os.stat(source)
+            except OSError:
+                continue
+            key['sources'].append({
+                'path': source,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+            })
+
+        return key
+
+    def hash_file(self, location):
+        digest = hashlib.sha1()
+        with open(location, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def load_snapshot(self, base_version=None):
+        """Load the compiled snapshot if it matches the current sources
+
+        With a base version, load it if it was compiled from that version
+        of the registry, regardless of the registry file's current state.
+        """
+        # The snapshot holds many small objects and none of them are garbage,
+        # so pausing the cyclic garbage collector makes loading much faster
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(self.snapshot_path, 'rb') as fp:
+                snapshot = pickle.load(fp)
+        except Exception:
+            # Missing, unreadable or from an incompatible version
+            return False
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        key = self.get_snapshot_key()
+        saved_key = snapshot.get('key', {})
+        if saved_key.get('format') != key['format'] \
+                or saved_key.get('minecraft_target') != key['minecraft_target'] \
+                or len(saved_key.get('sources', [])) != len(key['sources']):
+            return False
+
+        if base_version is not None:
+            # Deltas only apply to the remote registry by itself
+            if self.sources != [self.localdir] or snapshot.get('version_hash') != base_version:
+                return False
+            for field in self.snapshot_fields:
+                setattr(self, field, snapshot[field])
+            return True
+
+        touched = False
+        for saved_source, source in zip(saved_key['sources'], key['sources']):
+            if saved_source['path'] != source['path'] or saved_source['size'] != source['size']:
+                return False
+            if saved_source['mtime'] != source['mtime']:
+                # Only the mtime changed, the contents could still be the same
+                if saved_source.get('hash') != self.hash_file(source['path']):
+                    return False
+                touched = True
+
+        for field in self.snapshot_fields:
+            setattr(self, field, snapshot[field])
+
+        if touched:
+            self.save_snapshot()
+
+        return True
+
+    def save_snapshot(self):
+        """Save the populated packages and indexes as a compiled snapshot"""
+        key = self.get_snapshot_key()
+        for source in key['sources']:
+            source['hash'] = self.hash_file(source['path'])
+
+        snapshot = {'key': key}
+        for field in self.snapshot_fields:
+            snapshot[field] = getattr(self, field)
+
+        # Write to a temp file first so a concurrent run never reads a partial file
+        temp_path = "{}.{}.tmp".format(self.snapshot_path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as fp:
+                pickle.dump(snapshot, fp, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError:
+            # The snapshot is only an optimization
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
 
     def post_populate(self):
         """Processing of packages to occur after population"""
         self.packages.sort(key=attrgetter('name'))
         self.reduce_to_unique_packages()
         self.create_simple_name_index()
+        self.create_lookup_indexes()
+        self.search_index = SearchIndex(self.unique_packages)
+        self.trigram_index = TrigramIndex(self.unique_packages)
 
     def reduce_to_unique_packages(self):
         """Make a listing of packages with only the latest version for each one"""
@@ -173,11 +726,34 @@ class Repository(object):
 
         self.simple_name_packages = package_dict
 
+    def create_lookup_indexes(self):
+        """Make the dicts used to look up packages by name, version and filename"""
+        self.name_index = {}
+        self.versions_index = {}
+        self.version_index = {}
+        self.simple_version_index = {}
+        self.filename_index = {}
+
+        for package in self.unique_packages:
+            self.name_index[package.name] = package
+
+        # Packages are sorted by name, so the first package wins on conflicts
+        for package in self.packages:
+            self.versions_index.setdefault(package.name, []).append(package)
+            self.version_index.setdefault((package.name, package.version), package)
+            self.simple_version_index.setdefault((package.get_simple_name(), package.version), package)
+            if package.filename:
+                self.filename_index.setdefault(package.filename, package)
+            self.filename_index.setdefault(package.get_local_filename(), package)
+
     def compare_versions(self, version1, version2):
         return cmp(self.normalize_version(version1), self.normalize_version(version2))
 
     def normalize_version(self, v):
-        return [x for x in re.sub(r'(\.0+)*$','', v).split(".")]
+        """Get a key to compare versions by, with the numbers in each part
+        compared as numbers (so 1.10 is newer than 1.9)"""
+        parts = re.sub(r'(\.0+)*$', '', v).split(".")
+        return [[(0, int(x)) if x.isdigit() else (1, x) for x in re.findall(r'\d+|\D+', part)] for part in parts]
 
     def count_packages(self):
         return len(self.packages)
@@ -188,14 +764,14 @@ class Repository(object):
 
         if ":" in name:
             namepart,versionpart = name.split(":")
-            for package in self.packages:
-                if (package.name == namepart or package.get_simple_name() == namepart) and package.version == versionpart:
-                    return package
+            if (namepart, versionpart) in self.version_index:
+                return self.version_index[(namepart, versionpart)]
+            if (namepart, versionpart) in self.simple_version_index:
+                return self.simple_version_index[(namepart, versionpart)]
         else:
             # Only select from the latest versions (unique_packages)
-            for package in self.unique_packages:
-                if package.name == name:
-                    return package
+            if name in self.name_index:
+                return self.name_index[name]
 
             # Try to find based on the mod name (without vendor)
             if name in self.simple_name_packages:
@@ -206,32 +782,43 @@ class Repository(object):
 
         return False
 
+    def fetch_package_versions(self, name):
+        """Get every version of a package for the targeted minecraft version,
+        latest version first"""
+        versions = []
+        for package in self.versions_index.get(name, []):
+            if package.get_minecraft_version() == self.minecraft_target:
+                versions.append(package)
+
+        versions.sort(key=cmp_to_key(lambda a, b: self.compare_versions(b.version, a.version)))
+        return versions
+
     def fetch_package_byfilename(self, filename):
-        for package in self.packages:
-            if package.filename == filename or package.get_local_filename() == filename:
-                return package
+        return self.filename_index.get(filename, False)
 
-        return False
+    def search(self, term, fuzzy=False):
+        """Search the latest packages, best match first
 
-    def search(self, term):
+        Every word of the term must match the start of a word in the
+        package's name, keywords or description. Use `OR` or `|` to
+        search for alternatives. In fuzzy mode, or when nothing matches,
+        packages with names similar to the term are returned instead.
+        """
         results = []
-        for package in self.unique_packages:
-            if term in re.split('\W?', package.name):
-                results.append(package)
-                continue
-            if term in package.description.split():
-                results.append(package)
-                continue
-            if term in package.keywords:
-                results.append(package)
-                continue
+        if not fuzzy:
+            for name in self.search_index.search(term):
+                results.append(self.name_index[name])
 
         if len(results) == 0:
-            # Hmm, no results? try harder
-            for package in self.unique_packages:
-                if term in package.name or term in package.description:
-                    results.append(package)
-                    continue
+            # Hmm, no results? Maybe it's misspelled
+            for name in self.trigram_index.search(term):
+                results.append(self.name_index[name])
 
-        results.sort(key=attrgetter('name'))
         return results
+
+    def suggest_packages(self, name, limit=3):
+        """Get the names of packages with a name similar to the given one"""
+        if ":" in name:
+            name = name.split(":")[0]
+
+        return self.trigram_index.search(name, limit)
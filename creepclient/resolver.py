@@ -0,0 +1,227 @@
+"""Dependency resolver for packages"""
+
+import re # Regular expressions
+
+
+class DependencyError(Exception):
+    """Raised when a set of packages can't be resolved into an install plan"""
+    pass
+
+
+class Resolver(object):
+    """Resolve a list of package names into an ordered install plan
+
+    The transitive closure of the requested packages is built once, each
+    package appears in it only once, version constraints from `require` are
+    honored and the result is ordered so dependencies come before the
+    packages that need them.
+    """
+
+    # Requirements that are not packages in the repository
+    platform_requirements = ['minecraft', 'forge']
+
+    def __init__(self, repository, include_dependencies=True):
+        self.repository = repository
+        self.include_dependencies = include_dependencies
+
+        # Names that could not be found in the repository
+        self.unknown = []
+
+        # Dependencies that were not followed (when not including dependencies)
+        self.skipped = []
+
+    def resolve(self, packagenames):
+        """Resolve the package names into a list of packages in install order"""
+        self.unknown = []
+        self.skipped = []
+
+        # Selected package for each package name
+        selected = {}
+
+        # Version constraints for each package name, by the name requiring it
+        constraints = {}
+
+        # Packages explicitly requested with a version (vendor/name:version)
+        pinned = {}
+
+        roots = []
+        for packagename in packagenames:
+            package = self.repository.fetch_package(packagename)
+            if not package:
+                self.unknown.append(packagename)
+                continue
+            if package.name not in roots:
+                roots.append(package.name)
+            if ':' in packagename:
+                pinned[package.name] = package
+            elif package.name not in pinned:
+                selected[package.name] = package
+
+        selected.update(pinned)
+
+        # Package whose requirements have been followed, by name. A package
+        # is expanded again only if a new constraint changed its version.
+        expanded = {}
+
+        # Names whose constraints conflicted, put back in the queue in case a
+        # package requiring them switches to a version that drops them
+        deferred = set()
+
+        queue = list(roots)
+        while queue:
+            name = queue.pop(0)
+            try:
+                package = self.select(name, constraints.get(name, {}), selected, pinned)
+            except DependencyError:
+                if queue and name not in deferred:
+                    deferred.add(name)
+                    queue.append(name)
+                    continue
+                raise
+            previous = expanded.get(name)
+            if previous is package:
+                continue
+            deferred.clear()
+            if previous is not None:
+                # The requirements of the version no longer selected don't apply
+                for dependency, constraint in self.get_requirements(previous):
+                    constraints.get(dependency, {}).pop(name, None)
+            expanded[name] = package
+
+            for dependency, constraint in self.get_requirements(package):
+                constraints.setdefault(dependency, {})[package.name] = constraint
+                queue.append(dependency)
+
+        return self.order(roots, selected)
+
+    def select(self, name, constraints, selected, pinned):
+        """Select the version of a package satisfying all its constraints"""
+        current = selected.get(name)
+
+        if current is not None and self.satisfies_all(current.version, constraints):
+            return current
+
+        if name in pinned:
+            raise DependencyError(self.describe_conflict(name, constraints, pinned[name].version))
+
+        # Prefer the newest version available for the targeted minecraft version
+        for candidate in self.repository.fetch_package_versions(name):
+            if self.satisfies_all(candidate.version, constraints):
+                selected[name] = candidate
+                return candidate
+
+        raise DependencyError(self.describe_conflict(name, constraints))
+
+    def get_requirements(self, package):
+        """Get the (name, constraint) pairs of packages required by a package
+
+        Requirement names are normalized to the full package name. Unknown
+        requirements are recorded in `unknown` and not returned, and nothing
+        is returned when not including dependencies.
+        """
+        requirements = []
+        for dependency, constraint in package.require.items():
+            if dependency in self.platform_requirements:
+                continue
+
+            if not self.include_dependencies:
+                if dependency not in self.skipped:
+                    self.skipped.append(dependency)
+                continue
+
+            name = self.get_canonical_name(dependency)
+            if name is None:
+                if dependency not in self.unknown:
+                    self.unknown.append(dependency)
+                continue
+
+            requirements.append((name, constraint))
+
+        return requirements
+
+    def get_canonical_name(self, name):
+        """Get the full package name (vendor/name) for a requirement name"""
+        if self.repository.fetch_package_versions(name):
+            return name
+
+        # Could be a simple name (without vendor)
+        package = self.repository.fetch_package(name)
+        if package:
+            return package.name
+
+        return None
+
+    def order(self, roots, selected):
+        """Order the closure of the roots so dependencies come first
+
+        Raises DependencyError if the dependencies form a cycle.
+        """
+        ordered = []
+        visited = {}
+        for root in roots:
+            self.visit(root, selected, visited, ordered, [])
+
+        return ordered
+
+    def visit(self, name, selected, visited, ordered, path):
+        state = visited.get(name)
+        if state == 'done':
+            return
+        if state == 'visiting':
+            cycle = path[path.index(name):] + [name]
+            raise DependencyError("Circular dependency: {}".format(' -> '.join(cycle)))
+
+        visited[name] = 'visiting'
+        package = selected[name]
+        for dependency, constraint in self.get_requirements(package):
+            self.visit(dependency, selected, visited, ordered, path + [name])
+
+        visited[name] = 'done'
+        ordered.append(package)
+
+    def satisfies_all(self, version, constraints):
+        for constraint in constraints.values():
+            if not self.satisfies(version, constraint):
+                return False
+
+        return True
+
+    def satisfies(self, version, constraint):
+        """Check a version against a constraint
+
+        Constraints are a version to match exactly, `*` for any version, or
+        one or more comparisons separated by commas, e.g. `>=1.2, <2.0`
+        """
+        constraint = constraint.strip() if constraint else ''
+        if constraint in ['', '*']:
+            return True
+
+        for part in constraint.split(','):
+            part = part.replace(' ', '')
+            if part == '':
+                continue
+            match = re.match(r'^(>=|<=|==|!=|>|<|=)?(.+)$', part)
+            operator, required = match.group(1) or '==', match.group(2)
+            result = self.repository.compare_versions(version, required)
+
+            if operator in ['==', '='] and result != 0:
+                return False
+            if operator == '!=' and result == 0:
+                return False
+            if operator == '>=' and result < 0:
+                return False
+            if operator == '<=' and result > 0:
+                return False
+            if operator == '>' and result <= 0:
+                return False
+            if operator == '<' and result >= 0:
+                return False
+
+        return True
+
+    def describe_conflict(self, name, constraints, pinned_version=None):
+        requirements = ["{} requires {}".format(parent, constraint) for parent, constraint in sorted(constraints.items())]
+        if pinned_version:
+            requirements.append("requested version {}".format(pinned_version))
+
+        return "No version of '{}' satisfies all requirements ({})".format(name, '; '.join(requirements))
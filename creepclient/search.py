@@ -0,0 +1,223 @@
+"""Search indexes for packages"""
+
+import bisect # Array bisection algorithm
+import re # Regular expressions
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens"""
+    return [token for token in re.split(r'[\W_]+', text.lower()) if token]
+
+
+def parse_query(query):
+    """Parse a search query into a list of alternatives, each a list of terms
+
+    Terms separated by spaces must all match. Alternatives are separated by
+    `OR` or `|`. A trailing `*` on a term is allowed but not needed, since
+    every term also matches as a prefix.
+
+    Example: 'iron furnace OR smelt*' -> [['iron', 'furnace'], ['smelt']]
+    """
+    alternatives = []
+    for alternative in re.split(r'\s+OR\s+|\|', query):
+        terms = []
+        for term in alternative.split():
+            terms.extend(tokenize(term))
+        if terms:
+            alternatives.append(terms)
+
+    return alternatives
+
+
+class SearchIndex(object):
+    """Inverted index of tokens to package names, with weighted fields"""
+
+    # Score of a match in each field
+    NAME_WEIGHT = 5
+    KEYWORD_WEIGHT = 3
+    DESCRIPTION_WEIGHT = 1
+
+    # Score multiplier for matching only the start of a token
+    PREFIX_FACTOR = 0.5
+
+    def __init__(self, packages=()):
+        # Scores for each package name, by token
+        self.postings = {}
+
+        # All tokens, sorted, for prefix lookups
+        self.tokens = []
+
+        for package in packages:
+            self.add(package)
+
+        self.tokens = sorted(self.postings)
+
+    def add(self, package):
+        for tokens, weight in self.get_fields(package):
+            for token in set(tokens):
+                scores = self.postings.setdefault(token, {})
+                scores[package.name] = scores.get(package.name, 0) + weight
+
+    def get_fields(self, package):
+        return [
+            (tokenize(package.name), self.NAME_WEIGHT),
+            (self.tokenize_keywords(package.keywords), self.KEYWORD_WEIGHT),
+            (tokenize(package.description), self.DESCRIPTION_WEIGHT),
+        ]
+
+    def update(self, removed, added):
+        """Replace some packages, keeping the sorted tokens up to date"""
+        for package in removed:
+            for tokens, weight in self.get_fields(package):
+                for token in set(tokens):
+                    scores = self.postings.get(token)
+                    if scores is None:
+                        continue
+                    scores.pop(package.name, None)
+                    if not scores:
+                        del self.postings[token]
+                        position = bisect.bisect_left(self.tokens, token)
+                        if position < len(self.tokens) and self.tokens[position] == token:
+                            del self.tokens[position]
+
+        for package in added:
+            new_tokens = set()
+            for tokens, weight in self.get_fields(package):
+                new_tokens.update(token for token in tokens if token not in self.postings)
+            for token in new_tokens:
+                bisect.insort(self.tokens, token)
+            self.add(package)
+
+    def tokenize_keywords(self, keywords):
+        """Keywords are comma separated phrases; index the words of each phrase"""
+        tokens = []
+        for keyword in keywords.split(','):
+            tokens.extend(tokenize(keyword))
+
+        return tokens
+
+    def match_term(self, term):
+        """Get the scores of the package names matching a term, including
+        tokens the term is a prefix of"""
+        scores = dict(self.postings.get(term, {}))
+
+        position = bisect.bisect_right(self.tokens, term)
+        while position < len(self.tokens) and self.tokens[position].startswith(term):
+            for name, score in self.postings[self.tokens[position]].items():
+                scores[name] = scores.get(name, 0) + score * self.PREFIX_FACTOR
+            position += 1
+
+        return scores
+
+    def search(self, query):
+        """Get the package names matching the query, best match first"""
+        results = {}
+        for terms in parse_query(query):
+            scores = None
+            for term in terms:
+                term_scores = self.match_term(term)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {name: scores[name] + term_scores[name] for name in scores if name in term_scores}
+                if not scores:
+                    break
+
+            for name, score in (scores or {}).items():
+                results[name] = max(results.get(name, 0), score)
+
+        return sorted(results, key=lambda name: (-results[name], name))
+
+
+def trigrams(text):
+    """Get the set of character trigrams of a text, padded at word edges"""
+    words = tokenize(text)
+    grams = set()
+    for word in words:
+        padded = '  ' + word + ' '
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+
+    return grams
+
+
+class TrigramIndex(object):
+    """Index of character trigrams of package names for typo-tolerant lookups
+
+    Candidates are found through the trigrams they share with the query, so
+    only names that have something in common with it are ever compared.
+    """
+
+    # Minimum similarity (0 to 1) for a name to be considered a match
+    THRESHOLD = 0.3
+
+    def __init__(self, packages=()):
+        # Package names, by trigram
+        self.postings = {}
+
+        # Number of trigrams of each indexed name, and the package it's for
+        self.sizes = {}
+
+        for package in packages:
+            self.add(package.name, package.name)
+            self.add(package.get_simple_name(), package.name)
+
+    def add(self, text, name):
+        grams = trigrams(text)
+        if not grams:
+            return
+
+        key = (text, name)
+        self.sizes[key] = len(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(key)
+
+    def remove(self, text, name):
+        key = (text, name)
+        if self.sizes.pop(key, None) is None:
+            return
+
+        for gram in trigrams(text):
+            keys = [other for other in self.postings.get(gram, []) if other != key]
+            if keys:
+                self.postings[gram] = keys
+            else:
+                self.postings.pop(gram, None)
+
+    def update(self, removed, added):
+        """Replace some packages"""
+        for package in removed:
+            self.remove(package.name, package.name)
+            self.remove(package.get_simple_name(), package.name)
+
+        for package in added:
+            self.add(package.name, package.name)
+            self.add(package.get_simple_name(), package.name)
+
+    def search(self, query, limit=None, threshold=None):
+        """Get the package names similar to the query, most similar first"""
+        if threshold is None:
+            threshold = self.THRESHOLD
+
+        grams = trigrams(query)
+        if not grams:
+            return []
+
+        shared = {}
+        for gram in grams:
+            for key in self.postings.get(gram, []):
+                shared[key] = shared.get(key, 0) + 1
+
+        # Similarity of the trigram sets (Jaccard index), best for each package
+        similarity = {}
+        for key, count in shared.items():
+            score = count / float(len(grams) + self.sizes[key] - count)
+            name = key[1]
+            if score >= threshold and score > similarity.get(name, 0):
+                similarity[name] = score
+
+        names = sorted(similarity, key=lambda name: (-similarity[name], name))
+        if limit:
+            names = names[:limit]
+
+        return names
@@ -0,0 +1,413 @@
+"""Repository for packages stored in an on-disk SQLite database"""
+
+import json # JSON encoder and decoder
+import os # Miscellaneous operating system interfaces
+import sqlite3 # DB-API 2.0 interface for SQLite databases
+
+from functools import cmp_to_key
+from .repository import Repository
+from .search import SearchIndex, TrigramIndex, parse_query
+
+
+class SqliteRepository(Repository):
+    """Repository that keeps the packages in a SQLite database
+
+    The registry files are loaded into the database once, and every lookup
+    afterwards is an indexed query instead of a scan through every package.
+    Meant for large registries; the in-memory Repository is the default.
+    """
+
+    # Format of the database, bump when the schema changes
+    schema_format = 3
+
+    schema = [
+        """CREATE TABLE meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )""",
+        """CREATE TABLE packages (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            simple_name TEXT NOT NULL,
+            version TEXT NOT NULL,
+            minecraft_version TEXT,
+            filename TEXT,
+            local_filename TEXT,
+            latest INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL
+        )""",
+        "CREATE INDEX packages_name ON packages (name)",
+        "CREATE INDEX packages_simple_name ON packages (simple_name)",
+        "CREATE INDEX packages_name_version ON packages (name, version)",
+        "CREATE INDEX packages_simple_name_version ON packages (simple_name, version)",
+        "CREATE INDEX packages_filename ON packages (filename)",
+        "CREATE INDEX packages_local_filename ON packages (local_filename)",
+        "CREATE INDEX packages_minecraft_version ON packages (minecraft_version, name)",
+        "CREATE INDEX packages_latest ON packages (latest, name)",
+    ]
+
+    def __init__(self, appdir):
+        self.db_path = appdir + os.sep + 'packages.db'
+        self.db = None
+
+        # Package entities already created, by row id, so the same package
+        # is always the same object
+        self.loaded_packages = {}
+
+        # Trigram index of the latest package names, built when first needed
+        self.latest_trigram_index = None
+
+        super(SqliteRepository, self).__init__(appdir)
+
+    @property
+    def packages(self):
+        if self.db is None:
+            return self._packages
+        return self.query_packages("SELECT id, data FROM packages ORDER BY name, id")
+
+    @packages.setter
+    def packages(self, value):
+        self._packages = value
+
+    @property
+    def unique_packages(self):
+        if self.db is None:
+            return self._unique_packages
+        return self.query_packages("SELECT id, data FROM packages WHERE latest = 1 ORDER BY name")
+
+    @unique_packages.setter
+    def unique_packages(self, value):
+        self._unique_packages = value
+
+    def clear_cache(self):
+        super(SqliteRepository, self).clear_cache()
+        self.close()
+        if os.path.isfile(self.db_path):
+            os.remove(self.db_path)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+            self.loaded_packages = {}
+            self.latest_trigram_index = None
+
+    def load_sources(self):
+        """Load the database, rebuilding it if the sources changed"""
+        self.close()
+
+        key = self.get_snapshot_key()
+        db = self.open_database()
+        if db is not None:
+            meta = dict(db.execute("SELECT key, value FROM meta").fetchall())
+            if self.is_current(json.loads(meta.get('sources', '[]')), key['sources']):
+                self.db = db
+                self.version_hash = meta.get('version_hash', '')
+                self.version_date = meta.get('version_date', '')
+                if meta.get('minecraft_target') != self.minecraft_target:
+                    self.update_latest()
+                return
+            if self.changed_packages is not None and self.sources == [self.localdir] \
+                    and meta.get('version_hash') == self.delta_base_version:
+                # Only re-index the packages changed by the delta
+                self.db = db
+                self.update_changed_packages(key)
+                return
+            db.close()
+
+        self.build_database(key)
+        self.db = self.open_database()
+
+    def open_database(self):
+        if not os.path.isfile(self.db_path):
+            return None
+
+        try:
+            db = sqlite3.connect(self.db_path)
+            meta = dict(db.execute("SELECT key, value FROM meta").fetchall())
+        except sqlite3.Error:
+            return None
+
+        if meta.get('format') != str(self.schema_format):
+            db.close()
+            return None
+
+        return db
+
+    def is_current(self, saved_sources, sources):
+        """Check whether the database was built from the given sources"""
+        if len(saved_sources) != len(sources):
+            return False
+
+        for saved_source, source in zip(saved_sources, sources):
+            if saved_source['path'] != source['path'] or saved_source['size'] != source['size']:
+                return False
+            if saved_source['mtime'] != source['mtime'] \
+                    and saved_source.get('hash') != self.hash_file(source['path']):
+                return False
+
+        return True
+
+    def build_database(self, key):
+        """Load all the sources into a new database"""
+        self._packages = []
+        for source in self.sources:
+            self.populate_from_registry(self.read_registry(source))
+
+        for source in key['sources']:
+            source['hash'] = self.hash_file(source['path'])
+
+        # Build into a temp file and swap it in so other runs never see a
+        # partially built database
+        temp_path = "{}.{}.tmp".format(self.db_path, os.getpid())
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        db = sqlite3.connect(temp_path)
+        for statement in self.schema:
+            db.execute(statement)
+        self.create_search_table(db)
+
+        self.insert_packages(db, self._packages)
+        self.populate_search_table(db)
+
+        db.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+            ('format', str(self.schema_format)),
+            ('sources', json.dumps(key['sources'])),
+            ('version_hash', self.version_hash),
+            ('version_date', self.version_date),
+        ])
+        db.commit()
+
+        self.update_latest(db)
+        db.close()
+
+        os.replace(temp_path, self.db_path)
+        self._packages = []
+
+    def insert_packages(self, db, packages):
+        rows = []
+        for package in packages:
+            rows.append((
+                package.name,
+                package.get_simple_name(),
+                package.version,
+                package.require.get('minecraft'),
+                package.filename,
+                package.get_local_filename(),
+                json.dumps(package.__dict__),
+            ))
+        db.executemany(
+            "INSERT INTO packages (name, simple_name, version, minecraft_version, filename, local_filename, data)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+    def update_changed_packages(self, key):
+        """Replace the rows of the packages changed by a delta"""
+        names = [(name,) for name in self.changed_packages]
+        packages = []
+        for versions in self.changed_packages.values():
+            for data in versions.values():
+                packages.append(self.create_package(data))
+
+        has_search_table = self.has_fts()
+        if has_search_table:
+            self.db.executemany("DELETE FROM search WHERE rowid IN (SELECT id FROM packages WHERE name = ?)", names)
+        self.db.executemany("DELETE FROM packages WHERE name = ?", names)
+
+        first_id = self.db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM packages").fetchone()[0]
+        self.insert_packages(self.db, packages)
+        if has_search_table:
+            self.db.execute(
+                "INSERT INTO search (rowid, name, description, keywords)"
+                " SELECT id, name, json_extract(data, '$.description'), json_extract(data, '$.keywords')"
+                " FROM packages WHERE id >= ?",
+                (first_id,)
+            )
+
+        for source in key['sources']:
+            source['hash'] = self.hash_file(source['path'])
+
+        self.version_hash, self.version_date = self.delta_version
+        self.db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+            ('sources', json.dumps(key['sources'])),
+            ('version_hash', self.version_hash),
+            ('version_date', self.version_date),
+        ])
+        self.db.commit()
+        self.update_latest()
+
+    def create_search_table(self, db):
+        """Create the full-text index, if SQLite was built with FTS5"""
+        try:
+            db.execute("CREATE VIRTUAL TABLE search USING fts5(name, description, keywords)")
+            self.has_search_table = True
+        except sqlite3.OperationalError:
+            self.has_search_table = False
+
+    def populate_search_table(self, db):
+        if not self.has_search_table:
+            return
+
+        db.execute(
+            "INSERT INTO search (rowid, name, description, keywords)"
+            " SELECT id, name, json_extract(data, '$.description'), json_extract(data, '$.keywords')"
+            " FROM packages"
+        )
+
+    def update_latest(self, db=None):
+        """Flag the latest version of each package for the targeted minecraft version"""
+        db = db or self.db
+
+        latest = {}
+        rows = db.execute(
+            "SELECT id, name, version FROM packages WHERE minecraft_version = ?",
+            (self.minecraft_target,)
+        )
+        for row_id, name, version in rows:
+            if name not in latest or self.compare_versions(version, latest[name][1]) > 0:
+                latest[name] = (row_id, version)
+
+        db.execute("UPDATE packages SET latest = 0 WHERE latest = 1")
+        db.executemany("UPDATE packages SET latest = 1 WHERE id = ?", [(row_id,) for row_id, version in latest.values()])
+        db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('minecraft_target', ?)", (self.minecraft_target,))
+        db.commit()
+        self.latest_trigram_index = None
+
+    def set_minecraft_target(self, target):
+        super(SqliteRepository, self).set_minecraft_target(target)
+        if self.db is not None:
+            self.update_latest()
+
+    def query_packages(self, query, parameters=()):
+        packages = []
+        for row_id, data in self.db.execute(query, parameters):
+            if row_id not in self.loaded_packages:
+                self.loaded_packages[row_id] = self.create_package(json.loads(data))
+            packages.append(self.loaded_packages[row_id])
+
+        return packages
+
+    def query_package(self, query, parameters=()):
+        packages = self.query_packages(query + " LIMIT 1", parameters)
+        return packages[0] if packages else False
+
+    def count_packages(self):
+        return self.db.execute("SELECT COUNT(*) FROM packages").fetchone()[0]
+
+    def fetch_package(self, name):
+        if name == '':
+            return False
+
+        if ":" in name:
+            namepart,versionpart = name.split(":")
+            package = self.query_package(
+                "SELECT id, data FROM packages WHERE name = ? AND version = ? ORDER BY id",
+                (namepart, versionpart)
+            )
+            if not package:
+                package = self.query_package(
+                    "SELECT id, data FROM packages WHERE simple_name = ? AND version = ? ORDER BY name, id",
+                    (namepart, versionpart)
+                )
+            return package
+
+        # Only select from the latest versions
+        package = self.query_package("SELECT id, data FROM packages WHERE latest = 1 AND name = ?", (name,))
+        if package:
+            return package
+
+        # Try to find based on the mod name (without vendor)
+        packages = self.query_packages("SELECT id, data FROM packages WHERE latest = 1 AND simple_name = ?", (name,))
+        if len(packages) > 1:
+            print("Multiple packages exist with name '{name}'".format(name=name))
+            return False
+        if packages:
+            return packages[0]
+
+        return False
+
+    def fetch_package_versions(self, name):
+        versions = self.query_packages(
+            "SELECT id, data FROM packages WHERE name = ? AND minecraft_version = ?",
+            (name, self.minecraft_target)
+        )
+        versions.sort(key=cmp_to_key(lambda a, b: self.compare_versions(b.version, a.version)))
+        return versions
+
+    def fetch_package_byfilename(self, filename):
+        return self.query_package(
+            "SELECT id, data FROM packages WHERE filename = ? OR local_filename = ? ORDER BY name, id",
+            (filename, filename)
+        )
+
+    def search(self, term, fuzzy=False):
+        """Search the latest packages, best match first
+
+        Uses the same query syntax as the in-memory repository, run against
+        the full-text index and ranked with bm25.
+        """
+        results = []
+        if not fuzzy:
+            results = self.search_text(term)
+
+        if len(results) == 0:
+            # Hmm, no results? Maybe it's misspelled
+            for name in self.get_trigram_index().search(term):
+                results.append(self.fetch_package(name))
+
+        return results
+
+    def suggest_packages(self, name, limit=3):
+        if ":" in name:
+            name = name.split(":")[0]
+
+        return self.get_trigram_index().search(name, limit)
+
+    def get_trigram_index(self):
+        if self.latest_trigram_index is None:
+            self.latest_trigram_index = TrigramIndex(self.unique_packages)
+
+        return self.latest_trigram_index
+
+    def search_text(self, term):
+        alternatives = parse_query(term)
+        if not alternatives:
+            return []
+
+        if self.has_fts():
+            # Every term is quoted so it's matched as text, and as a prefix
+            query = ' OR '.join(
+                '(' + ' AND '.join('"{}"*'.format(term) for term in terms) + ')'
+                for terms in alternatives
+            )
+            return self.query_packages(
+                "SELECT packages.id, packages.data FROM search JOIN packages ON packages.id = search.rowid"
+                " WHERE search MATCH ? AND packages.latest = 1"
+                " ORDER BY bm25(search, ?, ?, ?), packages.name",
+                (query, SearchIndex.NAME_WEIGHT, SearchIndex.DESCRIPTION_WEIGHT, SearchIndex.KEYWORD_WEIGHT)
+            )
+
+        # No full-text index, fall back to matching words in the text
+        results = {}
+        for terms in alternatives:
+            conditions = []
+            parameters = []
+            for term in terms:
+                conditions.append(
+                    "(name LIKE ? OR json_extract(data, '$.description') LIKE ?"
+                    " OR json_extract(data, '$.keywords') LIKE ?)"
+                )
+                parameters.extend(['%' + term + '%'] * 3)
+            for package in self.query_packages(
+                "SELECT id, data FROM packages WHERE latest = 1 AND " + ' AND '.join(conditions) + " ORDER BY name",
+                parameters
+            ):
+                results[package.name] = package
+
+        return [results[name] for name in sorted(results)]
+
+    def has_fts(self):
+        row = self.db.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'search'").fetchone()
+        return row[0] > 0
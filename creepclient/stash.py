@@ -0,0 +1,88 @@
+"""Stashes of installed mods"""
+
+import json # JSON encoder and decoder
+import os # Miscellaneous operating system interfaces
+
+from .manifest import Manifest
+
+
+class Stash(object):
+    """A set of mods put aside, to be restored later
+
+    The stash directory holds the mods directory itself, moved there with a
+    single rename (along with its manifest), and stash.json, which lists the
+    stashed files with the SHA-256 of each. The files are hard links to the
+    objects of the artifact store, so stashes of similar sets of mods share
+    their bytes with each other and with the cache.
+
+    Stashes saved before stash.json hold their files directly in the stash
+    directory.
+    """
+
+    FILENAME = 'stash.json'
+
+    # Version of the stash.json format
+    stash_format = 1
+
+    # Files in a mods directory that aren't mods
+    IGNORED_FILES = ['.DS_Store', Manifest.FILENAME]
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.index_path = path + os.sep + self.FILENAME
+
+        # SHA-256 and size of each file, by file name
+        self.files = None
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def is_legacy(self):
+        return not os.path.isfile(self.index_path)
+
+    def get_files_dir(self):
+        if self.is_legacy():
+            return self.path
+
+        return self.path + os.sep + 'mods'
+
+    def load(self):
+        if self.files is not None:
+            return self.files
+
+        self.files = {}
+        if not self.is_legacy():
+            try:
+                with open(self.index_path) as fp:
+                    data = json.load(fp)
+                if data.get('stash_format') == self.stash_format:
+                    self.files = data['files']
+                    return self.files
+            except (OSError, ValueError, KeyError):
+                pass
+
+        # Old or unreadable stash, go by the files
+        for name in self.list_files(self.get_files_dir()):
+            self.files[name] = {'sha256': None, 'size': None}
+
+        return self.files
+
+    def save(self):
+        data = {
+            'stash_format': self.stash_format,
+            'files': self.files or {},
+        }
+
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as fp:
+            json.dump(data, fp, indent=2)
+        os.replace(temp_path, self.index_path)
+
+    @classmethod
+    def list_files(cls, directory):
+        """List the mods in a directory"""
+        try:
+            return sorted(name for name in os.listdir(directory) if name not in cls.IGNORED_FILES)
+        except OSError:
+            return []
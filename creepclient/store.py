@@ -0,0 +1,386 @@
+"""Content-addressed store for downloaded artifacts"""
+
+import hashlib # Secure hashes and message digests
+import json # JSON encoder and decoder
+import os # Miscellaneous operating system interfaces
+import shutil # High-level file operations
+import threading # Thread-based parallelism
+import time # Time access and conversions
+
+from . import fileops
+
+
+class ArtifactStore(object):
+    """Store of downloaded artifacts, keyed by the SHA-256 of their contents
+
+    Cached files (cache/<installdir>/<filename>) are hard links to a single
+    object in cache/objects, so the same bytes published under different
+    names or versions are only stored once. The index remembers the hash
+    and size of each cached file so it doesn't have to be hashed again.
+
+    Objects that stashes hold can't be evicted, so their size is accounted
+    for separately and doesn't count toward the maximum size.
+    """
+
+    # Size of the chunks files are read in when hashing
+    CHUNK_SIZE = 1024 * 1024
+
+    # Maximum total size of the stored objects in bytes, 0 for no limit
+    max_size = 0
+
+    def __init__(self, cachedir, max_size=0):
+        self.max_size = max_size
+        self.cachedir = cachedir
+        self.objectsdir = cachedir + os.sep + 'objects'
+        self.extracteddir = cachedir + os.sep + 'extracted'
+        self.index_path = cachedir + os.sep + 'index.json'
+
+        self.index = None
+        self.changed = False
+        self.lock = threading.RLock()
+
+    def load_index(self):
+        if self.index is not None:
+            return self.index
+
+        try:
+            with open(self.index_path) as fp:
+                self.index = json.load(fp)
+        except (OSError, ValueError):
+            self.index = {}
+
+        self.index.setdefault('files', {})
+
+        # Size and last access time of each object, by hash
+        self.index.setdefault('objects', {})
+
+        # Total size of the objects, kept up to date so checking the limit
+        # doesn't need a walk through the cache
+        self.index.setdefault('total_size', 0)
+
+        # Size of the objects held by stashes, part of the total size
+        self.index.setdefault('stashed_size', 0)
+
+        for entry in self.index['files'].values():
+            if entry['sha256'] not in self.index['objects']:
+                # Cached before sizes and access times were tracked
+                self.index['objects'][entry['sha256']] = {'size': entry['size'], 'atime': 0}
+                self.index['total_size'] += entry['size']
+                self.changed = True
+
+        return self.index
+
+    def save(self):
+        """Save the index, if anything changed"""
+        with self.lock:
+            if not self.changed:
+                return
+
+            temp_path = "{}.{}.tmp".format(self.index_path, os.getpid())
+            with open(temp_path, 'w') as fp:
+                json.dump(self.index, fp)
+            os.replace(temp_path, self.index_path)
+            self.changed = False
+
+    def get_key(self, path):
+        """Get the index key for a file in the cache"""
+        return os.path.relpath(path, self.cachedir).replace(os.sep, '/')
+
+    def get_object_path(self, digest):
+        return self.objectsdir + os.sep + digest[:2] + os.sep + digest
+
+    def get_extracted_dir(self, digest, strategy):
+        """Get the directory for the output of an install strategy run on an object"""
+        strategy_digest = hashlib.sha256(strategy.encode('utf-8')).hexdigest()
+        return self.extracteddir + os.sep + digest + '-' + strategy_digest[:12]
+
+    def hash_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(self.CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def get_digest(self, path):
+        """Get the SHA-256 of a cached file, hashing it only if unknown"""
+        with self.lock:
+            entry = self.load_index()['files'].get(self.get_key(path))
+
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+
+        if entry and entry['size'] == size:
+            self.touch(entry['sha256'])
+            return entry['sha256']
+
+        return self.add_file(path)
+
+    def has_file(self, path, expected=None):
+        """Check whether a file is in the cache, with the expected hash if given
+
+        A cached file that doesn't match the expected hash is removed.
+        """
+        if not os.path.isfile(path):
+            return False
+
+        digest = self.get_digest(path)
+        if expected and digest != expected.lower():
+            os.remove(path)
+            return False
+
+        return bool(digest)
+
+    def add_file(self, path, expected=None):
+        """Add a downloaded file to the store
+
+        The file is verified against the expected hash if one is given; a
+        file that doesn't match is removed. Returns the hash of the file, or
+        False if it didn't match.
+        """
+        digest = self.hash_file(path)
+        if expected and digest != expected.lower():
+            print("Checksum mismatch for '{}': expected {}, got {}".format(path, expected, digest))
+            os.remove(path)
+            return False
+
+        self.link_object(path, digest)
+        with self.lock:
+            self.load_index()['files'][self.get_key(path)] = {
+                'sha256': digest,
+                'size': os.path.getsize(path),
+            }
+            self.changed = True
+
+        return digest
+
+    def add_object(self, path, digest=None):
+        """Make a file outside of the cache (e.g. a stashed mod) share the
+        object of its contents
+
+        The file is only hashed if no hash is given or it isn't already a
+        link to that object. Returns the hash of the file.
+        """
+        object_path = self.get_object_path(digest) if digest else None
+        if not object_path or not os.path.isfile(object_path) or not os.path.samefile(path, object_path):
+            digest = self.hash_file(path)
+
+        self.link_object(path, digest)
+        self.set_stashed(digest, True)
+        return digest
+
+    def set_stashed(self, digest, stashed):
+        """Record whether a stash holds an object"""
+        with self.lock:
+            index = self.load_index()
+            entry = index['objects'].get(digest)
+            if entry is None or bool(entry.get('stashed')) == stashed:
+                return
+
+            if stashed:
+                entry['stashed'] = True
+                index['stashed_size'] += entry['size']
+            else:
+                del entry['stashed']
+                index['stashed_size'] -= entry['size']
+            self.changed = True
+
+    def update_stashed(self, digests):
+        """Record the objects held by stashes, given all of their hashes,
+        e.g. after a stash was dropped"""
+        with self.lock:
+            for digest in list(self.load_index()['objects']):
+                self.set_stashed(digest, digest in digests)
+
+    def link_object(self, path, digest):
+        """Share the bytes of a file with the object of its hash, making the
+        file the object if there is none yet"""
+        object_path = self.get_object_path(digest)
+
+        with self.lock:
+            if os.path.isfile(object_path):
+                # Already have these bytes, share them
+                if not os.path.samefile(path, object_path):
+                    self.link_file(object_path, path)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                try:
+                    os.link(path, object_path)
+                except OSError:
+                    # No hard links on this filesystem, nothing to share
+                    pass
+
+            size = os.path.getsize(path)
+            index = self.load_index()
+            if digest not in index['objects']:
+                index['objects'][digest] = {'size': size, 'atime': 0}
+                index['total_size'] += size
+            self.touch(digest)
+            self.changed = True
+
+    def touch(self, digest):
+        """Record that an object was just used"""
+        with self.lock:
+            entry = self.load_index()['objects'].get(digest)
+            if entry is not None:
+                entry['atime'] = int(time.time())
+                self.changed = True
+
+    def get_stats(self):
+        index = self.load_index()
+        return {
+            'objects': len(index['objects']),
+            'files': len(index['files']),
+            'total_size': index['total_size'],
+            'stashed_size': index['stashed_size'],
+            'max_size': self.max_size,
+        }
+
+    def get_object_files(self):
+        """Get the cached file keys of each object, by hash"""
+        files = {}
+        for key, entry in self.load_index()['files'].items():
+            files.setdefault(entry['sha256'], []).append(key)
+
+        return files
+
+    def is_in_use(self, digest, keys, protected_keys):
+        """Check whether an object is used outside of the cache
+
+        Installed files are hard links to the object, so it is in use when it
+        has more links than the cache itself accounts for. Where files were
+        copied instead, the caller passes the keys of the files known to be
+        installed or stashed, and the hashes of the stashed files.
+        """
+        if digest in protected_keys:
+            return True
+
+        for key in keys:
+            if key in protected_keys:
+                return True
+
+        try:
+            links = os.stat(self.get_object_path(digest)).st_nlink
+        except OSError:
+            return False
+
+        cached_links = 1
+        for key in keys:
+            path = self.cachedir + os.sep + key.replace('/', os.sep)
+            if os.path.isfile(path) and os.path.samefile(path, self.get_object_path(digest)):
+                cached_links += 1
+
+        return links > cached_links
+
+    def get_evictable_size(self):
+        """Get the size counted toward the maximum: that of the objects not
+        held by stashes"""
+        index = self.load_index()
+        return index['total_size'] - index['stashed_size']
+
+    def is_over_limit(self):
+        return bool(self.max_size) and self.get_evictable_size() > self.max_size
+
+    def evict(self, max_size, protected_keys=()):
+        """Remove the least recently used objects not in use until the total
+        size is at most max_size. Returns the hashes of the removed objects."""
+        with self.lock:
+            index = self.load_index()
+            object_files = self.get_object_files()
+
+            evicted = []
+            by_access = sorted(index['objects'].items(), key=lambda item: item[1]['atime'])
+            for digest, entry in by_access:
+                if self.get_evictable_size() <= max_size:
+                    break
+                keys = object_files.get(digest, [])
+                if self.is_in_use(digest, keys, protected_keys):
+                    continue
+                self.remove_object(digest, keys)
+                evicted.append(digest)
+
+            return evicted
+
+    def remove_object(self, digest, keys):
+        index = self.load_index()
+        for key in keys:
+            path = self.cachedir + os.sep + key.replace('/', os.sep)
+            if os.path.isfile(path):
+                os.remove(path)
+            index['files'].pop(key, None)
+
+        object_path = self.get_object_path(digest)
+        if os.path.isfile(object_path):
+            os.remove(object_path)
+
+        # What install strategies extracted from it
+        if os.path.isdir(self.extracteddir):
+            for name in os.listdir(self.extracteddir):
+                if name.startswith(digest + '-'):
+                    shutil.rmtree(self.extracteddir + os.sep + name)
+
+        entry = index['objects'].pop(digest, None)
+        if entry:
+            index['total_size'] -= entry['size']
+            if entry.get('stashed'):
+                index['stashed_size'] -= entry['size']
+        self.changed = True
+
+    def collect_garbage(self, protected_keys=()):
+        """Drop index entries of missing files and objects nothing refers to,
+        then evict down to the maximum size"""
+        with self.lock:
+            index = self.load_index()
+            for key in list(index['files']):
+                if not os.path.isfile(self.cachedir + os.sep + key.replace('/', os.sep)):
+                    del index['files'][key]
+                    self.changed = True
+
+            object_files = self.get_object_files()
+            removed = []
+            for digest in list(index['objects']):
+                if digest not in object_files and not self.is_in_use(digest, [], protected_keys):
+                    self.remove_object(digest, [])
+                    removed.append(digest)
+
+        if self.max_size:
+            removed.extend(self.evict(self.max_size, protected_keys))
+
+        return removed
+
+    def clear(self):
+        """Remove every cached file and object"""
+        with self.lock:
+            for name in os.listdir(self.cachedir):
+                path = self.cachedir + os.sep + name
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+
+            self.index = None
+            self.changed = False
+
+    def link_file(self, source, destination):
+        """Replace destination with a hard link to source, if possible"""
+        temp_path = destination + '.creep-tmp'
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            return False
+
+        os.replace(temp_path, destination)
+        return True
+
+    def install_file(self, source, destination):
+        """Put a cached file at destination without copying its bytes if possible
+
+        See fileops.copy_file for the ways it is copied.
+        """
+        entry = self.load_index()['files'].get(self.get_key(source))
+        if entry:
+            self.touch(entry['sha256'])
+
+        fileops.copy_file(source, destination)
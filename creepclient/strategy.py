@@ -0,0 +1,446 @@
+"""Install strategies for packages that are archives"""
+
+import errno # Standard errno system symbols
+import fnmatch # Unix filename pattern matching
+import hashlib # Secure hashes and message digests
+import os # Miscellaneous operating system interfaces
+import shlex # Lexical analysis of user input.
+import shutil # High-level file operations
+import threading # Thread-based parallelism
+import time # Time access and conversions
+import zipfile # Zip file utilities
+
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import fileops
+
+
+class StrategyError(Exception):
+    """Raised when an install strategy can't be parsed or run"""
+    pass
+
+
+class StrategyContext(object):
+    """State shared by the steps of a strategy run"""
+
+    def __init__(self, archive_path, outputdir):
+        self.archive_path = archive_path
+        self.outputdir = outputdir
+
+        # Members of the archive (zipfile.ZipInfo)
+        self.members = []
+
+        # Selected members and where they go (relative to the install dir),
+        # in the order they were selected
+        self.selection = []
+
+        # Members selected by steps adding to the selection at the same
+        # time, by step index, until they are added to the selection
+        self.selection_parts = {}
+
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.archives = []
+
+    def open_archive(self):
+        """Get this thread's handle on the archive, so members can be read in
+        parallel without sharing a file position"""
+        if not hasattr(self.local, 'archive'):
+            self.local.archive = zipfile.ZipFile(self.archive_path)
+            with self.lock:
+                self.archives.append(self.local.archive)
+
+        return self.local.archive
+
+    def close(self):
+        for archive in self.archives:
+            archive.close()
+        self.archives = []
+
+    def add_selection(self, step, selected):
+        with self.lock:
+            self.selection_parts[step.index] = selected
+
+    def get_selection(self):
+        """Get the selection, with what steps added to it in step order"""
+        with self.lock:
+            for index in sorted(self.selection_parts):
+                self.selection.extend(self.selection_parts.pop(index))
+
+        return self.selection
+
+    def get_output_path(self, path):
+        return self.outputdir + os.sep + path.replace('/', os.sep)
+
+
+class Step(ABC):
+    """A step of a strategy
+
+    Steps declare the resources they use and produce: 'archive' (the list of
+    members), 'selection' (the members to install and their paths) and
+    'files' (the extracted files). A step runs once the earlier steps
+    producing what it uses are done, and steps that don't depend on each
+    other run at the same time.
+    """
+
+    name = ''
+    inputs = ()
+    outputs = ()
+
+    # Whether the step only adds to its outputs, so it can run at the same
+    # time as other steps adding to them
+    appends = False
+
+    # Whether the step only prepares the output, and can be skipped when the
+    # output of the strategy is already cached
+    builds_output = True
+
+    def __init__(self, args):
+        self.args = args
+
+        # Position in the strategy, set by InstallStrategy
+        self.index = None
+
+        self.parse(args)
+
+    def parse(self, args):
+        pass
+
+    @abstractmethod
+    def run(self, context):
+        pass
+
+    def describe(self):
+        return ' '.join([self.name] + self.args)
+
+    def is_safe_path(self, path):
+        parts = path.split('/')
+        return bool(path) and not path.startswith('/') and '..' not in parts and ':' not in parts[0]
+
+
+class UnzipStep(Step):
+    """unzip : read the list of members of the artifact, a zip archive"""
+
+    name = 'unzip'
+    outputs = ('archive',)
+
+    def run(self, context):
+        try:
+            context.members = [info for info in context.open_archive().infolist() if not info.is_dir()]
+        except (OSError, zipfile.BadZipFile) as e:
+            raise StrategyError("Can't read archive '{}': {}".format(context.archive_path, e))
+
+
+class MoveStep(Step):
+    """move <path> or move <path>/* : install the contents of a directory of
+    the archive"""
+
+    name = 'move'
+    inputs = ('archive',)
+    outputs = ('selection',)
+    appends = True
+
+    def parse(self, args):
+        if not args:
+            raise StrategyError("move: missing path")
+
+        path = args[0]
+        if path[-2:] == '/*':
+            path = path[:-2]
+        path = path.strip('/')
+        self.prefix = path + '/' if path not in ['', '.'] else ''
+
+    def run(self, context):
+        selected = []
+        for info in context.members:
+            if info.filename.startswith(self.prefix):
+                path = info.filename[len(self.prefix):]
+                if self.is_safe_path(path):
+                    selected.append((info, path))
+
+        context.add_selection(self, selected)
+
+
+class ExtractStep(Step):
+    """extract <glob> [<dir>] : install the members matching a pattern, by
+    their file name, into a directory (default the install dir itself)"""
+
+    name = 'extract'
+    inputs = ('archive',)
+    outputs = ('selection',)
+    appends = True
+
+    def parse(self, args):
+        if not args:
+            raise StrategyError("extract: missing pattern")
+
+        self.pattern = args[0]
+        self.directory = args[1].strip('/') if len(args) > 1 else ''
+
+    def run(self, context):
+        selected = []
+        for info in context.members:
+            if fnmatch.fnmatchcase(info.filename, self.pattern):
+                path = info.filename.split('/')[-1]
+                if self.directory:
+                    path = self.directory + '/' + path
+                if self.is_safe_path(path):
+                    selected.append((info, path))
+
+        context.add_selection(self, selected)
+
+
+class RenameStep(Step):
+    """rename <from> <to> : change where a selected file or directory goes"""
+
+    name = 'rename'
+    inputs = ('selection',)
+    outputs = ('selection',)
+
+    def parse(self, args):
+        if len(args) < 2:
+            raise StrategyError("rename: expected <from> <to>")
+
+        self.source = args[0].strip('/')
+        self.destination = args[1].strip('/')
+        if not self.is_safe_path(self.destination):
+            raise StrategyError("rename: invalid path '{}'".format(args[1]))
+
+    def run(self, context):
+        renamed = []
+        for info, path in context.get_selection():
+            if path == self.source:
+                path = self.destination
+            elif path.startswith(self.source + '/'):
+                path = self.destination + path[len(self.source):]
+            renamed.append((info, path))
+
+        context.selection = renamed
+
+
+class WriteStep(Step):
+    """Extract the selected members, in parallel (added automatically)"""
+
+    name = 'write'
+    inputs = ('selection',)
+    outputs = ('files',)
+
+    # Number of members extracted at the same time
+    workers = 4
+
+    # Size of the chunks members are extracted in
+    CHUNK_SIZE = 1024 * 1024
+
+    def run(self, context):
+        # The last member selected for a path wins
+        members = {}
+        for info, path in context.get_selection():
+            members[path] = info
+
+        if len(members) < 2:
+            for path, info in members.items():
+                self.write_member(context, info, path)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.write_member, context, info, path) for path, info in members.items()]
+            for future in futures:
+                future.result()
+
+    def write_member(self, context, info, path):
+        destination = context.get_output_path(path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        try:
+            with context.open_archive().open(info) as src, open(destination, 'wb') as dst:
+                shutil.copyfileobj(src, dst, self.CHUNK_SIZE)
+        except (zipfile.BadZipFile, RuntimeError) as e:
+            raise StrategyError("Can't extract '{}': {}".format(info.filename, e))
+
+
+class VerifyStep(Step):
+    """verify <path> [<sha256>] : check that a file was installed, and its
+    hash if given"""
+
+    name = 'verify'
+    inputs = ('files',)
+    builds_output = False
+
+    def parse(self, args):
+        if not args:
+            raise StrategyError("verify: missing path")
+
+        self.path = args[0].strip('/')
+        self.sha256 = args[1].lower() if len(args) > 1 else None
+
+    def run(self, context):
+        path = context.get_output_path(self.path)
+        if not os.path.isfile(path):
+            raise StrategyError("verify: '{}' was not installed".format(self.path))
+
+        if self.sha256:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            if digest.hexdigest() != self.sha256:
+                raise StrategyError("verify: '{}' doesn't match its hash".format(self.path))
+
+
+class InstallStrategy(object):
+    """Run the `installstrategy` of a package
+
+    A strategy is a list of steps separated by semicolons, e.g.
+    `unzip; move shaders/*; verify final.fsh`. See step_types for the steps.
+
+    Only the archive members the steps select are read, and they are
+    streamed from the archive straight into an output directory (cached per
+    artifact), from which they are linked into the install directory.
+    """
+
+    # Step classes by name. Add to it (see register_step) for new steps.
+    step_types = {
+        'unzip': UnzipStep,
+        'move': MoveStep,
+        'extract': ExtractStep,
+        'rename': RenameStep,
+        'verify': VerifyStep,
+    }
+
+    # Number of steps run at the same time
+    workers = 4
+
+    @classmethod
+    def register_step(cls, step_class):
+        cls.step_types[step_class.name] = step_class
+
+    def __init__(self, installstrategy):
+        self.steps = []
+        for part in installstrategy.split(';'):
+            args = shlex.split(part)
+            if not args:
+                continue
+            if args[0] not in self.step_types:
+                raise StrategyError("Unknown strategy step '{}'".format(args[0]))
+            self.steps.append(self.step_types[args[0]](args[1:]))
+
+        # The selected members are extracted once everything is selected
+        producers = [i for i, step in enumerate(self.steps) if 'selection' in step.outputs]
+        if producers:
+            self.steps.insert(producers[-1] + 1, WriteStep([]))
+
+        for i, step in enumerate(self.steps):
+            step.index = i
+
+        self.dependencies = self.get_dependencies()
+
+        # Seconds each step took, in the order of the steps (None if skipped)
+        self.timings = []
+
+    def get_dependencies(self):
+        """Get the indexes of the steps each step has to wait for: earlier
+        steps producing what it uses, or producing the same thing unless
+        both only add to it"""
+        dependencies = []
+        for i, step in enumerate(self.steps):
+            needs = set()
+            for j in range(i):
+                earlier = self.steps[j]
+                if set(earlier.outputs) & set(step.inputs):
+                    needs.add(j)
+                elif set(earlier.outputs) & set(step.outputs) and not (earlier.appends and step.appends):
+                    needs.add(j)
+            for resource in step.inputs:
+                if not any(resource in self.steps[j].outputs for j in range(i)):
+                    raise StrategyError("Strategy step '{}' needs a step producing '{}' before it".format(step.describe(), resource))
+            dependencies.append(needs)
+
+        return dependencies
+
+    def run(self, archive_path, outputdir, savedir):
+        """Build the output of the strategy into outputdir, unless it already
+        is, and install it into savedir. Returns the installed paths."""
+        cached = os.path.isdir(outputdir)
+        temp_dir = "{}.{}.tmp".format(outputdir, os.getpid())
+
+        context = StrategyContext(archive_path, outputdir if cached else temp_dir)
+        if not cached:
+            os.makedirs(temp_dir)
+
+        try:
+            self.run_steps(context, skip_building=cached)
+            if not cached:
+                try:
+                    os.replace(temp_dir, outputdir)
+                except OSError as e:
+                    # Another run built the same output in the meantime, use it
+                    if e.errno not in (errno.ENOTEMPTY, errno.EEXIST) or not os.path.isdir(outputdir):
+                        raise
+        finally:
+            context.close()
+            if os.path.isdir(temp_dir):
+                shutil.rmtree(temp_dir)
+
+        return self.install_tree(outputdir, savedir)
+
+    def run_steps(self, context, skip_building=False):
+        """Run the steps, each as soon as the steps it depends on are done"""
+        self.timings = [None] * len(self.steps)
+        pending = set(range(len(self.steps)))
+        done = set()
+
+        if skip_building:
+            for i, step in enumerate(self.steps):
+                if step.builds_output:
+                    pending.discard(i)
+                    done.add(i)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = {}
+            while pending or running:
+                for i in sorted(pending):
+                    if self.dependencies[i] <= done:
+                        pending.discard(i)
+                        running[executor.submit(self.run_step, i, context)] = i
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i = running.pop(future)
+                    future.result()
+                    done.add(i)
+
+    def run_step(self, i, context):
+        start = time.perf_counter()
+        self.steps[i].run(context)
+        self.timings[i] = time.perf_counter() - start
+
+    def describe_timings(self):
+        parts = []
+        for step, timing in zip(self.steps, self.timings):
+            if timing is None:
+                parts.append("{} (cached)".format(step.name))
+            else:
+                parts.append("{} {:.3f}s".format(step.name, timing))
+
+        return ', '.join(parts)
+
+    def install_tree(self, source, destination):
+        """Link (or copy) every file of a directory into another one
+
+        Existing files are replaced rather than written over, since they can
+        be hard links shared with the cache or an installed profile.
+        """
+        pairs = []
+        for root, dirs, files in os.walk(source):
+            target = os.path.normpath(destination + os.sep + os.path.relpath(root, source))
+            if not os.path.isdir(target):
+                os.makedirs(target)
+            for name in files:
+                pairs.append((root + os.sep + name, target + os.sep + name))
+
+        failed = fileops.copy_files(pairs)
+        if failed:
+            source_path, destination_path, error = failed[0]
+            raise StrategyError("Can't install '{}': {}".format(destination_path, error))
+
+        return [destination_path for source_path, destination_path in pairs]
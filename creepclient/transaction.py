@@ -0,0 +1,187 @@
+"""Transactional installs into a profile"""
+
+import json # JSON encoder and decoder
+import os # Miscellaneous operating system interfaces
+import shutil # High-level file operations
+
+from . import fileops
+
+
+class InstallTransaction(object):
+    """Install packages into staging directories and swap them in at the end
+
+    Each profile directory packages are installed into (usually mods) is
+    cloned into a sibling staging directory with hard links, so no file is
+    copied. Packages are installed into the staging directories and recorded
+    in a journal as they complete, and on commit the staging directories are
+    swapped into place. Until then the profile is left untouched. A profile
+    directory that is a symbolic link stays one; the directory it points to
+    is swapped instead.
+
+    When an install is interrupted, the journal lets the next install finish
+    a commit that had started, or pick up where it stopped if it installs the
+    same packages.
+    """
+
+    STAGING_SUFFIX = '.creep-staging'
+    OLD_SUFFIX = '.creep-old'
+
+    def __init__(self, profiledir):
+        self.profiledir = profiledir
+        self.journal_path = profiledir + os.sep + '.creep-journal.json'
+        self.journal = None
+
+    def read_journal(self):
+        try:
+            with open(self.journal_path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def write_journal(self):
+        temp_path = self.journal_path + '.tmp'
+        with open(temp_path, 'w') as fp:
+            json.dump(self.journal, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temp_path, self.journal_path)
+
+    def begin(self, keys):
+        """Start a transaction installing the packages with the given keys
+
+        Returns True if an interrupted transaction for the same packages is
+        resumed.
+        """
+        journal = self.read_journal()
+        if journal and journal['state'] == 'committing':
+            # Interrupted while swapping the directories in, finish that first
+            self.finish_commit(journal)
+            journal = None
+
+        if journal and journal['packages'] == keys:
+            self.journal = journal
+            return True
+
+        if journal:
+            self.rollback(journal)
+
+        self.journal = {
+            'state': 'staging',
+            'packages': keys,
+            'dirs': [],
+            'inodes': {},
+            'done': [],
+        }
+        self.write_journal()
+        return False
+
+    def get_paths(self, installdir):
+        """Get the target, staging and old paths of a profile directory,
+        next to the directory a symbolic link points to"""
+        target = os.path.realpath(self.profiledir + os.sep + installdir)
+        return target, target + self.STAGING_SUFFIX, target + self.OLD_SUFFIX
+
+    def get_staging_dir(self, installdir):
+        """Get the staging directory to install into instead of a profile directory"""
+        target, staging, _ = self.get_paths(installdir)
+
+        if installdir not in self.journal['dirs']:
+            if os.path.isdir(staging):
+                # Left over from a clone that didn't finish
+                shutil.rmtree(staging)
+            self.clone_tree(target, staging)
+            self.journal['dirs'].append(installdir)
+            # Tells whether the staging directory was already swapped in
+            self.journal.setdefault('inodes', {})[installdir] = os.stat(staging).st_ino
+            self.write_journal()
+
+        return staging
+
+    def clone_tree(self, source, destination):
+        """Clone a directory using hard links where possible
+
+        Only the directory entries are created, one hard link per file; the
+        bytes of a file are only copied where it can't be linked. Symbolic
+        links are cloned as links.
+        """
+        os.makedirs(destination)
+        if not os.path.isdir(source):
+            return
+
+        files, dirs, failed = fileops.scan_tree(source)
+        if failed:
+            raise failed[0][1]
+
+        for directory in dirs:
+            os.mkdir(destination + directory[len(source):])
+
+        pairs = []
+        for path, stat in files:
+            clone = destination + path[len(source):]
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), clone)
+            else:
+                pairs.append((path, clone))
+
+        failed = fileops.copy_files(pairs)
+        if failed:
+            raise failed[0][2]
+
+    def is_done(self, key):
+        return key in self.journal['done']
+
+    def mark_done(self, key):
+        self.journal['done'].append(key)
+        self.write_journal()
+
+    def commit(self):
+        """Swap the staging directories into place"""
+        self.journal['state'] = 'committing'
+        self.write_journal()
+        self.finish_commit(self.journal)
+
+    def finish_commit(self, journal):
+        for installdir in journal['dirs']:
+            target, staging, old = self.get_paths(installdir)
+            inode = journal.get('inodes', {}).get(installdir)
+            if os.path.isdir(staging):
+                if inode is not None and self.get_inode(target) == inode:
+                    # Already exchanged, the old directory is left at the staging path
+                    shutil.rmtree(staging)
+                elif os.path.isdir(target) and fileops.exchange(staging, target):
+                    shutil.rmtree(staging)
+                else:
+                    self.replace_with_renames(target, staging, old)
+            if os.path.isdir(old):
+                shutil.rmtree(old)
+
+        os.remove(self.journal_path)
+
+    def replace_with_renames(self, target, staging, old):
+        """Put the staging directory in place of the target with two renames
+
+        Used where directories can't be exchanged atomically. Between the two
+        renames the target doesn't exist, so a game starting at that moment
+        would find no mods; if creep is interrupted there, the next install
+        finishes the commit from the journal.
+        """
+        if os.path.isdir(target):
+            if os.path.isdir(old):
+                shutil.rmtree(old)
+            os.rename(target, old)
+        os.rename(staging, target)
+
+    def get_inode(self, path):
+        try:
+            return os.stat(path).st_ino
+        except OSError:
+            return None
+
+    def rollback(self, journal):
+        """Throw away the staging directories of a transaction"""
+        for installdir in journal['dirs']:
+            _, staging, _ = self.get_paths(installdir)
+            if os.path.isdir(staging):
+                shutil.rmtree(staging)
+
+        os.remove(self.journal_path)
@@ -1,7 +1,14 @@
 class Terminfo(object):
     hasTerminfoDb = True
 
-    def __init__(self):
+    # The terminfo database is only loaded when a capability is first used
+    isSetup = False
+
+    def setup(self):
+        if self.isSetup:
+            return
+        self.isSetup = True
+
         # curses isn't available on all platforms
         try: import curses
         except:
@@ -19,6 +26,7 @@ class Terminfo(object):
         return default_method
 
     def hasCapability(self, capName):
+        self.setup()
         if not self.hasTerminfoDb:
             return False
 
@@ -27,6 +35,7 @@ class Terminfo(object):
         return result != None
 
     def doCapability(self, capName, *args):
+        self.setup()
         if not self.hasTerminfoDb:
             return ''
 
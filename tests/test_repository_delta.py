@@ -0,0 +1,268 @@
+"""Registry refreshes against a local stand-in for the registry server"""
+
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from creepclient.repository import Repository
+
+
+def package_data(name, version, minecraft='1.16.5', description='', filename=None, require=None):
+    requirements = {'minecraft': minecraft}
+    requirements.update(require or {})
+    return {
+        'name': name,
+        'version': version,
+        'description': description or 'The {} mod'.format(name),
+        'keywords': 'tools, things',
+        'require': requirements,
+        'filename': filename or '{}-{}.jar'.format(name.split('/')[1], version),
+        'url': 'http://localhost/{}-{}.jar'.format(name.replace('/', '_'), version),
+        'author': name.split('/')[0],
+        'type': 'mod',
+    }
+
+
+def registry(version, packages):
+    data = {'repository_version': version, 'date': '2026-10-0' + version[-1], 'packages': {}}
+    for package in packages:
+        data['packages'].setdefault(package['name'], {})[package['version']] = package
+
+    return data
+
+
+BASE_PACKAGES = [
+    package_data('aaa/shared', '1.0', filename='shared.jar'),
+    package_data('zzz/shared', '1.0', filename='shared.jar'),
+    package_data('vendor/tools', '1.9'),
+    package_data('vendor/tools', '1.10'),
+    package_data('vendor/tools', '1.8', minecraft='1.12.2'),
+    package_data('vendor/minimap', '2.0', description='A minimap for caves'),
+    package_data('other/furnace', '1.0', require={'vendor/tools': '>=1.9'}),
+]
+
+# From version v1 to v2: a new version, a changed description, a removed
+# version, a removed package shadowing another, and a new package
+DELTA = {
+    'base_version': 'v1',
+    'repository_version': 'v2',
+    'date': '2026-10-02',
+    'packages': {
+        'vendor/tools': {
+            '1.11': package_data('vendor/tools', '1.11'),
+            '1.9': None,
+        },
+        'vendor/minimap': {
+            '2.0': package_data('vendor/minimap', '2.0', description='A worldmap for oceans'),
+        },
+        'aaa/shared': None,
+        'new/shared': {
+            '1.0': package_data('new/shared', '1.0'),
+        },
+    },
+}
+
+
+def apply_delta(base, delta):
+    data = json.loads(json.dumps(base))
+    for name, versions in delta['packages'].items():
+        if versions is None:
+            data['packages'].pop(name, None)
+            continue
+        current = data['packages'].setdefault(name, {})
+        for version, package in versions.items():
+            if package is None:
+                current.pop(version, None)
+            else:
+                current[version] = package
+    data['repository_version'] = delta['repository_version']
+    data['date'] = delta['date']
+
+    return data
+
+
+class RegistryServer(http.server.ThreadingHTTPServer):
+    """Serves the registry with 200, 304 Not Modified or 226 IM Used (delta)"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RegistryHandler)
+        self.versions = {}
+        self.deltas = {}
+        self.current = None
+        self.statuses = []
+
+        # Fail requests for the whole registry, e.g. when going offline
+        self.fail_full_downloads = False
+
+    def publish(self, version, data, delta=None):
+        self.versions[version] = data
+        if delta:
+            self.deltas[delta['base_version']] = delta
+        self.current = version
+
+
+class RegistryHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        etag = '"{}"'.format(server.current)
+        client_etag = self.headers.get('If-None-Match')
+
+        if client_etag == etag:
+            self.respond(304, b'', etag)
+        elif 'creep-delta' in self.headers.get('A-IM', '') and client_etag and client_etag.strip('"') in server.deltas:
+            delta = server.deltas[client_etag.strip('"')]
+            self.respond(226, json.dumps(delta).encode('utf-8'), etag, {'IM': 'creep-delta'})
+        elif server.fail_full_downloads:
+            self.respond(500, b'', etag)
+        else:
+            self.respond(200, json.dumps(server.versions[server.current]).encode('utf-8'), etag)
+
+    def respond(self, status, body, etag, headers=None):
+        self.server.statuses.append(status)
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def describe_indexes(repository):
+    """Get the contents of the indexes of a repository, comparable with =="""
+    def describe(package):
+        return (package.name, package.version)
+
+    trigram_postings = {}
+    for gram, keys in repository.trigram_index.postings.items():
+        trigram_postings[gram] = sorted(keys)
+
+    return {
+        'version': (repository.version_hash, repository.version_date),
+        'packages': [describe(package) for package in repository.packages],
+        'unique_packages': [describe(package) for package in repository.unique_packages],
+        'simple_name_packages': {key: [describe(package) for package in packages] for key, packages in repository.simple_name_packages.items()},
+        'name_index': {key: describe(package) for key, package in repository.name_index.items()},
+        'versions_index': {key: [describe(package) for package in packages] for key, packages in repository.versions_index.items()},
+        'version_index': {key: describe(package) for key, package in repository.version_index.items()},
+        'simple_version_index': {key: describe(package) for key, package in repository.simple_version_index.items()},
+        'filename_index': {key: describe(package) for key, package in repository.filename_index.items()},
+        'search_postings': repository.search_index.postings,
+        'search_tokens': repository.search_index.tokens,
+        'trigram_postings': trigram_postings,
+        'trigram_sizes': repository.trigram_index.sizes,
+    }
+
+
+class RepositoryDeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.appdir = tempfile.mkdtemp()
+        self.server = RegistryServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.base = registry('v1', BASE_PACKAGES)
+        self.server.publish('v1', self.base)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.appdir)
+
+    def create_repository(self, cache_life=Repository.cache_life):
+        repository = Repository(self.appdir)
+        repository.remote_url = 'http://127.0.0.1:{}/packages.json'.format(self.server.server_address[1])
+        repository.cache_life = cache_life
+        repository.set_minecraft_target('1.16.5')
+        return repository
+
+    def test_full_download(self):
+        repository = self.create_repository()
+        repository.populate()
+
+        self.assertEqual([200], self.server.statuses)
+        self.assertEqual('v1', repository.version_hash)
+        self.assertEqual('1.10', repository.fetch_package('vendor/tools').version)
+
+    def test_not_modified(self):
+        self.create_repository().populate()
+
+        repository = self.create_repository()
+        repository.update_repository(force=True)
+
+        self.assertEqual([200, 304], self.server.statuses)
+        self.assertEqual('v1', repository.read_registry(repository.localdir)['repository_version'])
+
+    def test_delta_updates_only_the_changed_packages(self):
+        self.create_repository().populate()
+        self.server.publish('v2', apply_delta(self.base, DELTA), DELTA)
+
+        repository = self.create_repository(cache_life=-1)
+
+        def post_populate():
+            raise AssertionError("The delta rebuilt every index")
+        repository.post_populate = post_populate
+        repository.populate()
+
+        self.assertEqual([200, 226], self.server.statuses)
+        self.assertEqual(set(DELTA['packages']), set(repository.changed_packages))
+        self.assertEqual('1.11', repository.fetch_package('vendor/tools').version)
+        self.assertEqual('new/shared', repository.fetch_package('shared:1.0').name)
+        self.assertEqual('zzz/shared', repository.filename_index['shared.jar'].name)
+        self.assertEqual(['vendor/minimap'], [package.name for package in repository.search('oceans')])
+        self.assertEqual([], repository.search('caves'))
+
+        # Same indexes as reading the resulting registry from scratch
+        full = self.create_repository()
+        full.sources = [full.localdir]
+        full.populate_from_registry(full.read_registry(full.localdir))
+        full.post_populate()
+
+        self.assertEqual(describe_indexes(full), describe_indexes(repository))
+
+    def publish_unusable_delta(self):
+        """Publish v2 with a delta from v1 claiming another base version"""
+        delta = dict(DELTA, base_version='v0')
+        self.server.publish('v2', apply_delta(self.base, DELTA))
+        self.server.deltas['v1'] = delta
+
+    def test_unusable_delta_falls_back_to_full_download(self):
+        self.create_repository().populate()
+        self.publish_unusable_delta()
+
+        repository = self.create_repository(cache_life=-1)
+        repository.populate()
+
+        self.assertEqual([200, 226, 200], self.server.statuses)
+        self.assertEqual('v2', repository.version_hash)
+        self.assertEqual('1.11', repository.fetch_package('vendor/tools').version)
+
+    def test_failed_fallback_keeps_the_registry(self):
+        self.create_repository().populate()
+        self.publish_unusable_delta()
+        self.server.fail_full_downloads = True
+
+        repository = self.create_repository(cache_life=-1)
+        repository.populate()
+
+        self.assertEqual([200, 226, 500], self.server.statuses)
+        self.assertEqual('v1', repository.read_registry(repository.localdir)['repository_version'])
+        self.assertEqual('v1', repository.version_hash)
+        self.assertEqual('1.10', repository.fetch_package('vendor/tools').version)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+"""Resolving package names into an install plan"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from creepclient.repository import Repository
+from creepclient.resolver import DependencyError, Resolver
+
+
+def package_data(name, version, require=None, minecraft='1.16.5'):
+    requirements = {'minecraft': minecraft}
+    requirements.update(require or {})
+    return {
+        'name': name,
+        'version': version,
+        'description': 'The {} mod'.format(name),
+        'keywords': '',
+        'require': requirements,
+        'filename': '{}-{}.jar'.format(name.split('/')[1], version),
+        'url': 'http://localhost/{}-{}.jar'.format(name.replace('/', '_'), version),
+        'author': name.split('/')[0],
+        'type': 'mod',
+    }
+
+
+class ResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.appdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.appdir)
+
+    def create_resolver(self, packages, include_dependencies=True):
+        data = {'repository_version': 'v1', 'date': '2026-10-01', 'packages': {}}
+        for package in packages:
+            data['packages'].setdefault(package['name'], {})[package['version']] = package
+
+        path = self.appdir + os.sep + 'registry.json'
+        with open(path, 'w') as fp:
+            json.dump(data, fp)
+
+        repository = Repository(self.appdir)
+        repository.set_minecraft_target('1.16.5')
+        repository.populate(path)
+        return Resolver(repository, include_dependencies)
+
+    def resolve(self, resolver, names):
+        return [(package.name, package.version) for package in resolver.resolve(names)]
+
+    def test_dependencies_come_first(self):
+        resolver = self.create_resolver([
+            package_data('vendor/addon', '1.0', {'vendor/tools': '*', 'lib/core': '>=1.0'}),
+            package_data('vendor/tools', '2.0', {'lib/core': '*'}),
+            package_data('lib/core', '1.2'),
+        ])
+
+        self.assertEqual(
+            [('lib/core', '1.2'), ('vendor/tools', '2.0'), ('vendor/addon', '1.0')],
+            self.resolve(resolver, ['vendor/addon'])
+        )
+
+    def test_shared_dependency_appears_once(self):
+        resolver = self.create_resolver([
+            package_data('vendor/one', '1.0', {'lib/core': '*'}),
+            package_data('vendor/two', '1.0', {'core': '*'}),
+            package_data('lib/core', '1.0'),
+        ])
+
+        self.assertEqual(
+            [('lib/core', '1.0'), ('vendor/one', '1.0'), ('vendor/two', '1.0')],
+            self.resolve(resolver, ['vendor/one', 'vendor/two'])
+        )
+
+    def test_constraint_selects_an_older_version(self):
+        resolver = self.create_resolver([
+            package_data('vendor/addon', '1.0', {'lib/core': '>=1.0, <2.0'}),
+            package_data('lib/core', '1.5'),
+            package_data('lib/core', '2.1'),
+        ])
+
+        self.assertEqual(
+            [('lib/core', '1.5'), ('vendor/addon', '1.0')],
+            self.resolve(resolver, ['vendor/addon', 'lib/core'])
+        )
+
+    def test_conflicting_constraints(self):
+        resolver = self.create_resolver([
+            package_data('vendor/one', '1.0', {'lib/core': '<2.0'}),
+            package_data('vendor/two', '1.0', {'lib/core': '>=2.0'}),
+            package_data('lib/core', '1.5'),
+            package_data('lib/core', '2.1'),
+        ])
+
+        with self.assertRaises(DependencyError) as context:
+            resolver.resolve(['vendor/one', 'vendor/two'])
+        self.assertIn("'lib/core'", str(context.exception))
+
+    def test_pinned_version_conflict(self):
+        resolver = self.create_resolver([
+            package_data('vendor/addon', '1.0', {'lib/core': '>=2.0'}),
+            package_data('lib/core', '1.5'),
+            package_data('lib/core', '2.1'),
+        ])
+
+        with self.assertRaises(DependencyError) as context:
+            resolver.resolve(['lib/core:1.5', 'vendor/addon'])
+        self.assertIn("requested version 1.5", str(context.exception))
+
+    def test_circular_dependency(self):
+        resolver = self.create_resolver([
+            package_data('vendor/one', '1.0', {'vendor/two': '*'}),
+            package_data('vendor/two', '1.0', {'vendor/three': '*'}),
+            package_data('vendor/three', '1.0', {'vendor/one': '*'}),
+        ])
+
+        with self.assertRaises(DependencyError) as context:
+            resolver.resolve(['vendor/one'])
+        self.assertEqual(
+            "Circular dependency: vendor/one -> vendor/two -> vendor/three -> vendor/one",
+            str(context.exception)
+        )
+
+    def test_unknown_and_skipped_dependencies(self):
+        packages = [
+            package_data('vendor/addon', '1.0', {'lib/core': '*', 'lib/missing': '*'}),
+            package_data('lib/core', '1.0'),
+        ]
+
+        resolver = self.create_resolver(packages)
+        self.assertEqual([('lib/core', '1.0'), ('vendor/addon', '1.0')], self.resolve(resolver, ['vendor/addon', 'vendor/nothing']))
+        self.assertEqual(['vendor/nothing', 'lib/missing'], resolver.unknown)
+
+        resolver = self.create_resolver(packages, include_dependencies=False)
+        self.assertEqual([('vendor/addon', '1.0')], self.resolve(resolver, ['vendor/addon']))
+        self.assertEqual(['lib/core', 'lib/missing'], resolver.skipped)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Stashing the mods directory"""
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qi.console.terminal import Terminal
+
+from creepclient.creepclient import CreepClient
+
+
+class StashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.home = os.environ.get('HOME')
+        os.environ['HOME'] = self.tempdir
+
+        os.makedirs(self.tempdir + os.sep + '.minecraft')
+        self.client = CreepClient(terminal=Terminal())
+
+    def tearDown(self):
+        if self.home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = self.home
+        shutil.rmtree(self.tempdir)
+
+    def run_command(self, command):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.client.onecmd(command)
+
+    def create_mods(self, directory, names):
+        os.makedirs(directory, exist_ok=True)
+        for name in names:
+            with open(directory + os.sep + name, 'w') as fp:
+                fp.write(name)
+
+    def test_save_and_restore(self):
+        mods = self.client.profiledir + os.sep + 'mods'
+        self.create_mods(mods, ['a.jar', 'b.jar'])
+
+        self.assertFalse(self.run_command('stash save world'))
+        self.assertEqual([], os.listdir(mods))
+
+        self.assertFalse(self.run_command('stash restore world'))
+        self.assertEqual(['a.jar', 'b.jar'], sorted(name for name in os.listdir(mods) if name.endswith('.jar')))
+
+    def test_symlinked_mods_dir_is_kept(self):
+        target = self.tempdir + os.sep + 'realmods'
+        mods = self.client.profiledir + os.sep + 'mods'
+        self.create_mods(target, ['a.jar', 'b.jar'])
+        shutil.rmtree(mods, ignore_errors=True)
+        os.symlink(target, mods)
+
+        self.assertFalse(self.run_command('stash save world'))
+        self.assertTrue(os.path.islink(mods))
+        self.assertEqual(target, os.path.realpath(mods))
+        self.assertEqual([], [name for name in os.listdir(target) if name.endswith('.jar')])
+
+        # Installed while the stash was saved
+        self.create_mods(target, ['c.jar'])
+
+        self.assertFalse(self.run_command('stash restore world'))
+        self.assertTrue(os.path.islink(mods))
+        self.assertEqual(['a.jar', 'b.jar', 'c.jar'], sorted(name for name in os.listdir(target) if name.endswith('.jar')))
+
+
+if __name__ == '__main__':
+    unittest.main()
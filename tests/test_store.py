@@ -0,0 +1,104 @@
+"""Content-addressed store for downloaded artifacts"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from creepclient.store import ArtifactStore
+
+
+class ArtifactStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.store = ArtifactStore(self.tempdir + os.sep + 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def cache_file(self, name, size, atime):
+        """Add a file of the given size to the cache, last used at atime"""
+        directory = self.store.cachedir + os.sep + 'mods'
+        os.makedirs(directory, exist_ok=True)
+        path = directory + os.sep + name
+        with open(path, 'w') as fp:
+            fp.write(name[0] * size)
+
+        digest = self.store.add_file(path)
+        self.store.load_index()['objects'][digest]['atime'] = atime
+        return digest
+
+    def test_same_bytes_are_stored_once(self):
+        first = self.cache_file('a.jar', 100, 1)
+        directory = self.store.cachedir + os.sep + 'mods'
+        shutil.copyfile(directory + os.sep + 'a.jar', directory + os.sep + 'a-copy.jar')
+
+        self.assertEqual(first, self.store.add_file(directory + os.sep + 'a-copy.jar'))
+        self.assertEqual({'objects': 1, 'files': 2, 'total_size': 100, 'stashed_size': 0, 'max_size': 0}, self.store.get_stats())
+        self.assertTrue(os.path.samefile(directory + os.sep + 'a-copy.jar', self.store.get_object_path(first)))
+
+    def test_evicts_least_recently_used_first(self):
+        oldest = self.cache_file('a.jar', 100, 1)
+        newest = self.cache_file('b.jar', 100, 3)
+        older = self.cache_file('c.jar', 100, 2)
+
+        self.assertEqual([oldest, older], self.store.evict(100))
+        self.assertEqual(100, self.store.get_stats()['total_size'])
+        self.assertEqual([newest], list(self.store.load_index()['objects']))
+        self.assertFalse(os.path.exists(self.store.get_object_path(oldest)))
+        self.assertEqual(['b.jar'], os.listdir(self.store.cachedir + os.sep + 'mods'))
+
+    def test_installed_objects_are_not_evicted(self):
+        installed = self.cache_file('a.jar', 100, 1)
+        other = self.cache_file('b.jar', 100, 2)
+
+        # Installed as a hard link to the object
+        self.store.install_file(self.store.cachedir + os.sep + 'mods' + os.sep + 'a.jar', self.tempdir + os.sep + 'a.jar')
+
+        self.assertTrue(self.store.is_in_use(installed, ['mods/a.jar'], ()))
+        self.assertFalse(self.store.is_in_use(other, ['mods/b.jar'], ()))
+        self.assertEqual([other], self.store.evict(0))
+
+        os.remove(self.tempdir + os.sep + 'a.jar')
+        self.assertEqual([installed], self.store.evict(0))
+
+    def test_protected_keys_are_not_evicted(self):
+        protected = self.cache_file('a.jar', 100, 1)
+        other = self.cache_file('b.jar', 100, 2)
+
+        self.assertEqual([other], self.store.evict(0, protected_keys={'mods/a.jar'}))
+        self.assertEqual([], self.store.evict(0, protected_keys={protected}))
+
+    def test_stashed_objects_do_not_count_toward_the_limit(self):
+        stashed = self.cache_file('a.jar', 100, 1)
+        self.cache_file('b.jar', 100, 2)
+        self.store.max_size = 100
+
+        self.assertTrue(self.store.is_over_limit())
+        self.store.set_stashed(stashed, True)
+        self.assertEqual(100, self.store.get_evictable_size())
+        self.assertFalse(self.store.is_over_limit())
+
+        self.store.update_stashed(set())
+        self.assertEqual(0, self.store.get_stats()['stashed_size'])
+        self.assertTrue(self.store.is_over_limit())
+
+    def test_collect_garbage(self):
+        missing = self.cache_file('a.jar', 100, 1)
+        kept = self.cache_file('b.jar', 100, 2)
+        os.remove(self.store.cachedir + os.sep + 'mods' + os.sep + 'a.jar')
+
+        self.assertEqual([missing], self.store.collect_garbage())
+        self.assertEqual({'objects': 1, 'files': 1, 'total_size': 100, 'stashed_size': 0, 'max_size': 0}, self.store.get_stats())
+
+        self.store.save()
+        store = ArtifactStore(self.store.cachedir)
+        self.assertEqual(kept, store.get_digest(self.store.cachedir + os.sep + 'mods' + os.sep + 'b.jar'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Install strategies for packages that are archives"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from creepclient.strategy import InstallStrategy, StrategyError
+
+
+class InstallStrategyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.archive = self.tempdir + os.sep + 'pack.zip'
+        with zipfile.ZipFile(self.archive, 'w') as archive:
+            archive.writestr('shaders/final.fsh', 'final')
+            archive.writestr('shaders/lib/common.glsl', 'common')
+            archive.writestr('other/data.bin', 'data')
+            archive.writestr('readme.txt', 'readme')
+            archive.writestr('shaders/../escape.fsh', 'escape')
+
+        self.outputdir = self.tempdir + os.sep + 'output'
+        self.savedir = self.tempdir + os.sep + 'save'
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def list_files(self, directory):
+        files = []
+        for root, dirs, names in os.walk(directory):
+            for name in names:
+                files.append(os.path.relpath(root + os.sep + name, directory).replace(os.sep, '/'))
+
+        return sorted(files)
+
+    def test_steps(self):
+        strategy = InstallStrategy("unzip; move shaders/*; extract other/*.bin data; extract *.txt; rename lib glsl; verify glsl/common.glsl")
+        strategy.run(self.archive, self.outputdir, self.savedir)
+
+        self.assertEqual(
+            ['data/data.bin', 'final.fsh', 'glsl/common.glsl', 'readme.txt'],
+            self.list_files(self.savedir)
+        )
+        self.assertEqual(self.list_files(self.outputdir), self.list_files(self.savedir))
+        self.assertEqual(['output', 'pack.zip', 'save'], sorted(os.listdir(self.tempdir)))
+
+    def test_dependencies(self):
+        strategy = InstallStrategy("unzip; move shaders/*; extract *.txt; rename lib glsl; verify final.fsh")
+
+        self.assertEqual(['unzip', 'move', 'extract', 'rename', 'write', 'verify'], [step.name for step in strategy.steps])
+        # The two steps adding to the selection run at the same time
+        self.assertEqual([set(), {0}, {0}, {1, 2}, {1, 2, 3}, {4}], strategy.dependencies)
+
+    def test_invalid_strategies(self):
+        with self.assertRaises(StrategyError):
+            InstallStrategy("unzip; copy shaders/*")
+        with self.assertRaises(StrategyError):
+            InstallStrategy("move shaders/*; unzip")
+        with self.assertRaises(StrategyError):
+            InstallStrategy("unzip; move shaders/*; rename lib ../lib")
+
+    def test_failed_verify_leaves_no_output(self):
+        strategy = InstallStrategy("unzip; move shaders/*; verify missing.fsh")
+
+        with self.assertRaises(StrategyError):
+            strategy.run(self.archive, self.outputdir, self.savedir)
+        self.assertEqual(['pack.zip'], os.listdir(self.tempdir))
+
+    def test_cached_output_is_reused(self):
+        InstallStrategy("unzip; move shaders/*").run(self.archive, self.outputdir, self.savedir)
+
+        strategy = InstallStrategy("unzip; move shaders/*; verify final.fsh")
+        strategy.run(self.archive, self.outputdir, self.savedir + '2')
+
+        # Only the check runs, the output is not built again
+        self.assertEqual(['verify'], [step.name for step, timing in zip(strategy.steps, strategy.timings) if timing is not None])
+        self.assertEqual(self.list_files(self.savedir), self.list_files(self.savedir + '2'))
+
+    def test_output_built_by_another_run_meanwhile(self):
+        strategy = InstallStrategy("unzip; move shaders/*")
+        run_steps = strategy.run_steps
+
+        def run_steps_racing(context, skip_building=False):
+            run_steps(context, skip_building)
+            os.makedirs(self.outputdir)
+            with open(self.outputdir + os.sep + 'final.fsh', 'w') as fp:
+                fp.write('theirs')
+        strategy.run_steps = run_steps_racing
+
+        strategy.run(self.archive, self.outputdir, self.savedir)
+
+        self.assertEqual(['final.fsh'], self.list_files(self.savedir))
+        with open(self.savedir + os.sep + 'final.fsh') as fp:
+            self.assertEqual('theirs', fp.read())
+        self.assertEqual(['output', 'pack.zip', 'save'], sorted(os.listdir(self.tempdir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""Transactional installs into a profile"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from creepclient.transaction import InstallTransaction
+
+
+class InstallTransactionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.profiledir = tempfile.mkdtemp()
+        self.mods = self.profiledir + os.sep + 'mods'
+        os.makedirs(self.mods)
+        self.write(self.mods + os.sep + 'old.jar', 'old')
+
+    def tearDown(self):
+        shutil.rmtree(self.profiledir)
+
+    def write(self, path, contents):
+        with open(path, 'w') as fp:
+            fp.write(contents)
+
+    def stage(self, transaction, name):
+        """Install a file into the staging directory of the mods dir"""
+        staging = transaction.get_staging_dir('mods')
+        self.write(staging + os.sep + name, name)
+        transaction.mark_done(name)
+        return staging
+
+    def test_profile_untouched_until_commit(self):
+        transaction = InstallTransaction(self.profiledir)
+        self.assertFalse(transaction.begin(['new.jar']))
+        staging = self.stage(transaction, 'new.jar')
+
+        self.assertEqual(['new.jar', 'old.jar'], sorted(os.listdir(staging)))
+        self.assertEqual(['old.jar'], os.listdir(self.mods))
+
+        transaction.commit()
+
+        self.assertEqual(['new.jar', 'old.jar'], sorted(os.listdir(self.mods)))
+        self.assertFalse(os.path.exists(staging))
+        self.assertFalse(os.path.exists(transaction.journal_path))
+
+    def test_rollback(self):
+        transaction = InstallTransaction(self.profiledir)
+        transaction.begin(['new.jar'])
+        staging = self.stage(transaction, 'new.jar')
+
+        transaction.rollback(transaction.journal)
+
+        self.assertEqual(['old.jar'], os.listdir(self.mods))
+        self.assertFalse(os.path.exists(staging))
+        self.assertFalse(os.path.exists(transaction.journal_path))
+
+    def test_other_packages_roll_back_an_interrupted_install(self):
+        transaction = InstallTransaction(self.profiledir)
+        transaction.begin(['new.jar'])
+        staging = self.stage(transaction, 'new.jar')
+
+        transaction = InstallTransaction(self.profiledir)
+        self.assertFalse(transaction.begin(['other.jar']))
+
+        self.assertEqual(['old.jar'], os.listdir(self.mods))
+        self.assertFalse(os.path.exists(staging))
+        self.assertEqual([], transaction.journal['dirs'])
+
+    def test_same_packages_resume_an_interrupted_install(self):
+        transaction = InstallTransaction(self.profiledir)
+        transaction.begin(['new.jar', 'more.jar'])
+        self.stage(transaction, 'new.jar')
+
+        transaction = InstallTransaction(self.profiledir)
+        self.assertTrue(transaction.begin(['new.jar', 'more.jar']))
+        self.assertTrue(transaction.is_done('new.jar'))
+        self.assertFalse(transaction.is_done('more.jar'))
+
+        self.stage(transaction, 'more.jar')
+        transaction.commit()
+
+        self.assertEqual(['more.jar', 'new.jar', 'old.jar'], sorted(os.listdir(self.mods)))
+
+    def test_interrupted_commit_is_finished(self):
+        transaction = InstallTransaction(self.profiledir)
+        transaction.begin(['new.jar'])
+        target, staging, old = transaction.get_paths('mods')
+        self.stage(transaction, 'new.jar')
+        transaction.journal['state'] = 'committing'
+        transaction.write_journal()
+
+        # Interrupted between the two renames
+        os.rename(target, old)
+
+        transaction = InstallTransaction(self.profiledir)
+        self.assertFalse(transaction.begin(['other.jar']))
+
+        self.assertEqual(['new.jar', 'old.jar'], sorted(os.listdir(self.mods)))
+        self.assertFalse(os.path.exists(staging))
+        self.assertFalse(os.path.exists(old))
+
+    def test_symlinked_mods_dir_stays_a_link(self):
+        realmods = self.profiledir + os.sep + 'realmods'
+        os.rename(self.mods, realmods)
+        os.symlink(realmods, self.mods)
+
+        transaction = InstallTransaction(self.profiledir)
+        transaction.begin(['new.jar'])
+        self.stage(transaction, 'new.jar')
+        transaction.commit()
+
+        self.assertTrue(os.path.islink(self.mods))
+        self.assertEqual(['new.jar', 'old.jar'], sorted(os.listdir(realmods)))
+
+
+if __name__ == '__main__':
+    unittest.main()